@@ -0,0 +1,223 @@
+import os
+import sys
+import json
+import time
+import runpy
+import logging
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+import urllib.request
+from datetime import datetime, timedelta
+
+import standins
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Scripts in the order the workflow runs them
+SCRIPTS = {
+    'fillrate': 'WaterfallBot/PlacementFillRate/fillrate.py',
+    'waterfall': 'WaterfallBot/Waterfall/waterfall.py',
+    'duplicate': 'WaterfallBot/duplicate.py',
+    'dailyrev': 'Daily-Rev/dailyrev.py',
+}
+
+# The whole run in one process, including the Slack summary; compare against the scripts above
+ORCHESTRATOR = 'Orchestrator/orchestrator.py'
+
+
+# Count error log records so a failing script shows up in the report
+class ErrorCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+# Start the IronSource/Slack stand-in in its own process so it does not skew time and memory
+def start_standin(latency):
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'standins.py'), '--latency', str(latency)],
+        stdout=subprocess.PIPE, text=True
+    )
+    port = int(process.stdout.readline())
+    return process, f"http://127.0.0.1:{port}"
+
+
+def read_standin_counters(base_url):
+    with urllib.request.urlopen(f"{base_url}/_counters") as response:
+        return json.load(response)
+
+
+def configure_standin(base_url, rows_per_day):
+    urllib.request.urlopen(f"{base_url}/_configure?rows_per_day={rows_per_day}").close()
+
+
+# Set the environment every script reads at import time
+def configure_environment(base_url, real_quotas):
+    os.environ.update({
+        'IRONSOURCE_BASE_URL': base_url,
+        'IRONSOURCE_SECRET_KEY': 'benchmark',
+        'IRONSOURCE_REFRESH_TOKEN': 'benchmark',
+        'IRONSOURCE_APP_KEY_IOS': 'ios-app',
+        'IRONSOURCE_APP_KEY_ANDROID': 'android-app',
+        'GOOGLE_SHEET_ID': 'gather-sheet',
+        'GOOGLE_SHEET_DAILY_ID': 'daily-sheet',
+        'GOOGLE_SHEET_BLANK_WATERFALL_ID': 'blank-waterfall',
+        'GOOGLE_SHEET_WATERFALL_TAB': 'Waterfall',
+        'SHARE_EMAILS': ','.join(f"user{i}@example.com" for i in range(8)),
+        'SLACK_API_URL': base_url,
+        'SLACK_API_TOKEN': 'benchmark',
+        'SLACK_CHANNEL_ID': 'benchmark',
+    })
+    if not real_quotas:
+        for api in ('IRONSOURCE', 'SHEETS', 'DRIVE', 'SLACK'):
+            os.environ[f'{api}_RATE_PER_SECOND'] = '100000'
+
+
+# Replace the Google client libraries with the in-process fakes
+def patch_google(spreadsheets):
+    import gspread
+    import googleapiclient.discovery
+    from oauth2client import service_account
+
+    service_account.ServiceAccountCredentials = standins.FakeCredentials
+    gspread.authorize = lambda creds: standins.FakeClient(spreadsheets)
+    googleapiclient.discovery.build = lambda *args, **kwargs: standins.FakeDrive()
+
+
+# Drop the process-wide clients so each scenario starts cold in its own directory
+def reset_shared_state():
+    for module_name, attribute in (('ironsource_client', '_client'), ('stats_warehouse', '_warehouse'), ('rolling_stats', '_rolling_stats')):
+        module = sys.modules.get(module_name)
+        if module is not None:
+            setattr(module, attribute, None)
+    if 'google_clients' in sys.modules:
+        sys.modules['google_clients'].reset()
+
+
+# Run one script as __main__ and measure it
+def run_script(name, base_url, error_counter):
+    counters_before = read_standin_counters(base_url)
+    google_before = dict(standins.google_counters)
+    errors_before = error_counter.count
+    path = SCRIPTS.get(name, ORCHESTRATOR if name == 'orchestrator' else None)
+    sys.argv = [path]
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        runpy.run_path(os.path.join(REPO_ROOT, path), run_name='__main__')
+    except SystemExit:
+        pass
+    except Exception as e:
+        logging.error(f"{name} raised {e!r}")
+    wall = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    counters_after = read_standin_counters(base_url)
+    return {
+        'script': name,
+        'wall_seconds': round(wall, 3),
+        'ironsource_calls': counters_after['ironsource_calls'] - counters_before['ironsource_calls'],
+        'ironsource_bytes': counters_after['ironsource_bytes'] - counters_before['ironsource_bytes'],
+        'sheets_calls': standins.google_counters['sheets_calls'] - google_before['sheets_calls'],
+        'sheets_bytes': standins.google_counters['sheets_bytes'] - google_before['sheets_bytes'],
+        'drive_calls': standins.google_counters['drive_calls'] - google_before['drive_calls'],
+        'slack_calls': counters_after['slack_calls'] - counters_before['slack_calls'],
+        'peak_memory_mb': round(peak / 1024 / 1024, 2),
+        'errors': error_counter.count - errors_before,
+    }
+
+
+# Write an apps.json listing `apps` apps, alternating platforms, all on the default tabs
+def write_apps_config(apps):
+    with open('apps.json', 'w') as file:
+        json.dump({'apps': [
+            {'name': f"App {i}", 'platform': 'iOS' if i % 2 == 0 else 'Android', 'app_key': f"app-{i}"}
+            for i in range(apps)
+        ]}, file)
+
+
+# Run every script end to end for one dataset size
+def run_scenario(base_url, rows, scripts, sheets_latency, days, error_counter, apps=None):
+    # All apps together return `rows` instance rows per day; without a config there are two
+    configure_standin(base_url, max(1, rows // (apps or 2)))
+    workdir = tempfile.TemporaryDirectory(prefix=f'moonfrog-bench-{rows}-')
+    cwd = os.getcwd()
+    try:
+        os.chdir(workdir.name)
+        os.makedirs('Summary', exist_ok=True)
+        if apps:
+            write_apps_config(apps)
+
+        # The Raw Data tab is `days` behind, so dailyrev fetches that many days
+        spreadsheets = {}
+        daily = spreadsheets['daily-sheet'] = standins.FakeSpreadsheet(sheets_latency)
+        m1_date = (datetime.now() - timedelta(days=days + 1)).strftime('%m/%d/%Y')
+        daily.add_worksheet('Raw Data', [[''] * 12 + [m1_date]])
+        spreadsheets['gather-sheet'] = standins.FakeSpreadsheet(sheets_latency)
+        patch_google(spreadsheets)
+        reset_shared_state()
+
+        results = []
+        for name in scripts:
+            result = run_script(name, base_url, error_counter)
+            result['rows'] = rows
+            results.append(result)
+        return results
+    finally:
+        os.chdir(cwd)
+        workdir.cleanup()
+
+
+COLUMNS = ['rows', 'script', 'wall_seconds', 'ironsource_calls', 'ironsource_bytes', 'sheets_calls',
+           'sheets_bytes', 'drive_calls', 'slack_calls', 'peak_memory_mb', 'errors']
+
+
+def print_report(results):
+    widths = {column: max(len(column), *(len(str(result[column])) for result in results)) for column in COLUMNS}
+    print('  '.join(column.rjust(widths[column]) for column in COLUMNS))
+    for result in results:
+        print('  '.join(str(result[column]).rjust(widths[column]) for column in COLUMNS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run every script end to end against local IronSource, Sheets, Drive and Slack stand-ins")
+    parser.add_argument('--sizes', default='100,1000,10000,100000', help="Comma-separated instance rows per day")
+    parser.add_argument('--scripts', default=','.join(SCRIPTS), help="Comma-separated scripts to run, or 'orchestrator' for the whole run in one process")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds of latency per IronSource/Slack request")
+    parser.add_argument('--sheets-latency', type=float, default=0.0, help="Seconds of latency per Sheets request")
+    parser.add_argument('--days', type=int, default=7, help="Days dailyrev has to catch up")
+    parser.add_argument('--apps', type=int, help="Run against an apps.json with this many apps instead of the two env app keys")
+    parser.add_argument('--real-quotas', action='store_true', help="Keep the production rate limits of the request scheduler")
+    parser.add_argument('--json', help="Also write the results to this file")
+    args = parser.parse_args()
+
+    # Keep the scripts' INFO logging out of the report
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    error_counter = ErrorCounter()
+    logging.getLogger().addHandler(error_counter)
+
+    process, base_url = start_standin(args.latency)
+    try:
+        configure_environment(base_url, args.real_quotas)
+        results = []
+        for rows in (int(size) for size in args.sizes.split(',')):
+            results.extend(run_scenario(base_url, rows, args.scripts.split(','), args.sheets_latency, args.days, error_counter, args.apps))
+    finally:
+        process.terminate()
+        process.wait()
+    print_report(results)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,410 @@
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+AD_UNITS = ['Rewarded Video', 'Interstitial', 'Banner']
+AD_UNIT_FILTERS = {'Rewarded Video': 'rewardedVideo', 'Interstitial': 'interstitial', 'Banner': 'banner'}
+
+
+# ---------------------------------------------------------------------------
+# IronSource and Slack stand-in, run in its own process by the benchmark
+# ---------------------------------------------------------------------------
+
+# Metrics of one instance row; seeded per row, so a filtered query returns the same values as the full one
+def instance_metrics(app_key, day, k, rows_per_day):
+    rng = random.Random(f"{app_key}:{day}:{k}:{rows_per_day}")
+    impressions = rng.randint(0, 50000)
+    ecpm = round(rng.uniform(0.5, 40), 2)
+    return {
+        'revenue': round(impressions * ecpm / 1000, 2),
+        'eCPM': ecpm,
+        'impressions': impressions,
+        'adSourceAvailabilityRate': round(rng.uniform(0, 100), 2),
+        'adSourceChecks': rng.randint(impressions, impressions * 3 + 1)
+    }
+
+
+# Build a stats response for the requested breakdowns with rows_per_day rows per app key and day
+def build_stats(params, rows_per_day):
+    start = datetime.strptime(params['startDate'], "%Y-%m-%d").date()
+    end = datetime.strptime(params['endDate'], "%Y-%m-%d").date()
+    app_key = params['appKey']
+    breakdowns = params.get('breakdowns', '').split(',')
+    ad_unit_filter = params.get('adUnits')
+    ad_source_filter = params.get('adSource')
+    rng = random.Random(f"{app_key}:{params['startDate']}:{rows_per_day}")
+
+    # Without date and instance, one row per distinct ad unit and ad source with its impressions over the range
+    if 'instance' not in breakdowns and ('adUnits' in breakdowns or 'adSource' in breakdowns):
+        distinct = {}
+        day = start
+        while day <= end:
+            for k in range(rows_per_day):
+                ad_unit, provider = AD_UNITS[k % len(AD_UNITS)], f"Network {k % 12}"
+                if (ad_unit_filter and AD_UNIT_FILTERS[ad_unit] != ad_unit_filter) or (ad_source_filter and provider != ad_source_filter):
+                    continue
+                item = {'adUnits': ad_unit} if 'adUnits' in breakdowns else {}
+                if 'adSource' in breakdowns:
+                    item['providerName'] = provider
+                total = distinct.setdefault(tuple(item.values()), dict(item, data=[{'impressions': 0}]))
+                total['data'][0]['impressions'] += instance_metrics(app_key, day, k, rows_per_day)['impressions']
+            day += timedelta(days=1)
+        return list(distinct.values())
+
+    items = []
+    day = start
+    while day <= end:
+        if 'instance' in breakdowns:
+            for k in range(rows_per_day):
+                item = {
+                    'date': day.strftime("%Y-%m-%d"),
+                    'providerName': f"Network {k % 12}",
+                    'instanceName': f"Instance {k // 7}",
+                    'appName': f"App {app_key}",
+                    'adUnits': AD_UNITS[k % len(AD_UNITS)],
+                    'data': []
+                }
+                if 'mediationGroup' in breakdowns:
+                    item['mediationGroup'] = f"Group {k % 7}"
+                if ad_unit_filter and AD_UNIT_FILTERS[item['adUnits']] != ad_unit_filter:
+                    continue
+                if ad_source_filter and item['providerName'] != ad_source_filter:
+                    continue
+                item['data'].append(instance_metrics(app_key, day, k, rows_per_day))
+                items.append(item)
+        else:
+            impressions = rng.randint(10000, 5000000)
+            items.append({
+                'date': day.strftime("%Y-%m-%d"),
+                'appName': f"App {app_key}",
+                'data': [{
+                    'revenue': round(impressions * 0.012, 2),
+                    'eCPM': 12.0,
+                    'appFillRate': 95.5,
+                    'appRequests': impressions + 1000,
+                    'impressions': impressions,
+                    'activeUsers': 20000,
+                    'engagedUsers': 15000,
+                    'revenuePerActiveUser': 0.5,
+                    'revenuePerEngagedUser': 0.7
+                }]
+            })
+        day += timedelta(days=1)
+    return items
+
+
+# Serve the IronSource auth and v6 stats endpoints and the Slack methods the summary uses
+class StandInHandler(BaseHTTPRequestHandler):
+    rows_per_day = 100
+    latency = 0.0
+    counters = {'ironsource_calls': 0, 'ironsource_bytes': 0, 'slack_calls': 0, 'slack_bytes': 0}
+    slack_messages = []  # Newest first, like conversations.history
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body, counter=None, content_type='application/json'):
+        if counter:
+            with self.lock:
+                self.counters[f'{counter}_calls'] += 1
+                self.counters[f'{counter}_bytes'] += len(body)
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/_counters':
+            with self.lock:
+                return self._send(json.dumps(self.counters).encode())
+        if url.path == '/_configure':
+            # Switch the dataset size between benchmark scenarios
+            params = parse_qs(url.query)
+            StandInHandler.rows_per_day = int(params.get('rows_per_day', [self.rows_per_day])[0])
+            return self._send(b'{}')
+        time.sleep(self.latency)
+        if url.path.endswith('/auth'):
+            return self._send(b'"benchmark-token"', 'ironsource')
+        if url.path.endswith('/v6/stats'):
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            return self._send(json.dumps(build_stats(params, self.rows_per_day)).encode(), 'ironsource')
+        if url.path.endswith('/conversations.history'):
+            with self.lock:
+                messages = list(self.slack_messages)
+            return self._send(json.dumps({'ok': True, 'messages': messages}).encode(), 'slack')
+        self.send_error(404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        time.sleep(self.latency)
+        # Keep posted messages, so a second summary of the same day finds and updates the first
+        with self.lock:
+            if self.path.endswith('/chat.update'):
+                message = next((message for message in self.slack_messages if message['ts'] == payload.get('ts')), None)
+                if message is None:
+                    return self._send(json.dumps({'ok': False, 'error': 'message_not_found'}).encode(), 'slack')
+                message.update(text=payload.get('text'), metadata=payload.get('metadata'))
+            else:
+                message = {'ts': f"{time.time():.6f}", 'text': payload.get('text'), 'metadata': payload.get('metadata')}
+                self.slack_messages.insert(0, message)
+        return self._send(json.dumps({'ok': True, 'ts': message['ts']}).encode(), 'slack')
+
+
+# Entry point of the stand-in server process; prints the port it listens on
+def serve():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows-per-day', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+    StandInHandler.rows_per_day = args.rows_per_day
+    StandInHandler.latency = args.latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    print(server.server_port, flush=True)
+    server.serve_forever()
+
+
+# ---------------------------------------------------------------------------
+# In-process fake gspread and Drive backend
+# ---------------------------------------------------------------------------
+
+# Shared counters of the fake Google backend
+google_counters = {'sheets_calls': 0, 'sheets_bytes': 0, 'drive_calls': 0}
+
+
+def _column_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - 64
+    return index
+
+
+def _column_letters(index):
+    letters = ''
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+# Parse 'B2:J10', 'B1:J', 'A:B' or 'M1' (optionally prefixed with 'Tab'!) into 1-based bounds
+def parse_range(range_name):
+    range_name = range_name.split('!', 1)[-1]
+    match = re.fullmatch(r'([A-Z]+)(\d*)(?::([A-Z]+)(\d*))?', range_name)
+    if not match:
+        raise ValueError(f"Unsupported range {range_name}")
+    first_col, first_row, last_col, last_row = match.groups()
+    first_row = int(first_row) if first_row else 1
+    if last_col is None:
+        return first_row, _column_index(first_col), first_row, _column_index(first_col)
+    return first_row, _column_index(first_col), int(last_row) if last_row else None, _column_index(last_col)
+
+
+# Fake gspread Cell, enough for acell().value
+class FakeCell:
+    def __init__(self, value):
+        self.value = value
+
+
+# Fake gspread Worksheet keeping its values in memory.
+# Like gspread 3.7, row_count stays at the size the tab had when it was created; grid_rows is the real size.
+class FakeWorksheet:
+    def __init__(self, spreadsheet, title, rows=None, row_count=1000, latency=0.0):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.rows = [list(row) for row in rows or []]
+        self.row_count = self.grid_rows = max(row_count, len(self.rows))
+        self.latency = latency
+
+    def _call(self, payload=None):
+        time.sleep(self.latency)
+        google_counters['sheets_calls'] += 1
+        if payload is not None:
+            google_counters['sheets_bytes'] += len(json.dumps(payload))
+
+    def _read(self, range_name):
+        first_row, first_col, last_row, last_col = parse_range(range_name)
+        last_row = min(last_row or len(self.rows), len(self.rows))
+        values = []
+        for row in self.rows[first_row - 1:last_row]:
+            cells = row[first_col - 1:last_col]
+            while cells and cells[-1] in ('', None):
+                cells.pop()
+            values.append(cells)
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def _write(self, range_name, values):
+        first_row, first_col, _, _ = parse_range(range_name)
+        if first_row + len(values) - 1 > self.grid_rows:
+            raise ValueError(f"Range {range_name} exceeds grid limits. Max rows: {self.grid_rows}")
+        for offset, row in enumerate(values):
+            index = first_row - 1 + offset
+            while len(self.rows) <= index:
+                self.rows.append([])
+            target = self.rows[index]
+            if len(target) < first_col - 1 + len(row):
+                target.extend([''] * (first_col - 1 + len(row) - len(target)))
+            target[first_col - 1:first_col - 1 + len(row)] = row
+
+    def get(self, range_name=None, **kwargs):
+        values = self._read(range_name or 'A1:ZZ')
+        self._call(values)
+        return values
+
+    def batch_get(self, ranges, **kwargs):
+        values = [self._read(range_name) for range_name in ranges]
+        self._call(values)
+        return values
+
+    def col_values(self, col, **kwargs):
+        letters = _column_letters(col)
+        values = [row[0] if row else '' for row in self._read(f'{letters}1:{letters}')]
+        self._call(values)
+        return values
+
+    def acell(self, label, **kwargs):
+        values = self._read(label)
+        self._call(values)
+        return FakeCell(values[0][0] if values and values[0] else None)
+
+    def update(self, range_name, values=None, **kwargs):
+        self._call(values)
+        self._write(range_name, values)
+
+    def batch_update(self, data, **kwargs):
+        self._call(data)
+        for update in data:
+            self._write(update['range'], update['values'])
+
+    def append_rows(self, values, value_input_option='RAW', **kwargs):
+        self._call(values)
+        last = len(self.rows)
+        while last and not any(cell not in ('', None) for cell in self.rows[last - 1]):
+            last -= 1
+        self.grid_rows = max(self.grid_rows, last + len(values))
+        self._write(f'A{last + 1}', values)
+
+    def resize(self, rows=None, cols=None):
+        self._call()
+        if rows is not None:
+            self.grid_rows = rows
+
+    # gspread 3.7 resizes to the stale row_count plus rows
+    def add_rows(self, rows):
+        self.resize(rows=self.row_count + rows)
+
+    def clear_range(self, range_name):
+        first_row, first_col, last_row, last_col = parse_range(range_name)
+        if first_row > self.grid_rows:
+            raise ValueError(f"Range {range_name} exceeds grid limits. Max rows: {self.grid_rows}")
+        for row in self.rows[first_row - 1:last_row]:
+            for col in range(first_col - 1, min(last_col, len(row))):
+                row[col] = ''
+
+
+# Fake gspread Spreadsheet holding named FakeWorksheets
+class FakeSpreadsheet:
+    def __init__(self, latency=0.0):
+        self.worksheets = {}
+        self.latency = latency
+
+    def add_worksheet(self, title, rows=None, row_count=1000):
+        self.worksheets[title] = FakeWorksheet(self, title, rows, row_count, self.latency)
+        return self.worksheets[title]
+
+    def worksheet(self, title):
+        google_counters['sheets_calls'] += 1
+        if title not in self.worksheets:
+            self.add_worksheet(title)
+        return self.worksheets[title]
+
+    def _tab(self, range_name):
+        title = range_name.split('!', 1)[0].strip("'")
+        return self.worksheets[title]
+
+    def values_clear(self, range_name):
+        google_counters['sheets_calls'] += 1
+        self._tab(range_name).clear_range(range_name)
+
+    def values_batch_update(self, body=None, **kwargs):
+        google_counters['sheets_calls'] += 1
+        google_counters['sheets_bytes'] += len(json.dumps(body))
+        for update in body['data']:
+            self._tab(update['range'])._write(update['range'], update['values'])
+
+
+# Fake gspread client returned by the patched gspread.authorize
+class FakeClient:
+    def __init__(self, spreadsheets):
+        self.spreadsheets = spreadsheets
+
+    def open_by_key(self, key):
+        google_counters['sheets_calls'] += 1
+        return self.spreadsheets.setdefault(key, FakeSpreadsheet())
+
+
+# Fake googleapiclient request with execute()
+class FakeRequest:
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self, **kwargs):
+        google_counters['drive_calls'] += 1
+        return self.result
+
+
+# Fake Drive batch request, one call for every request added to it
+class FakeBatch:
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self.requests.append((request, callback or self.callback, request_id or str(len(self.requests))))
+
+    def execute(self, **kwargs):
+        google_counters['drive_calls'] += 1
+        for request, callback, request_id in self.requests:
+            if callback:
+                callback(request_id, request.result, None)
+
+
+# Fake Drive v3 service covering files().copy and permissions().create
+class FakeDrive:
+    def files(self):
+        return self
+
+    def permissions(self):
+        return self
+
+    def copy(self, fileId, body, **kwargs):
+        return FakeRequest({'id': f"copy-of-{fileId}", 'name': body.get('name')})
+
+    def create(self, fileId, body, **kwargs):
+        return FakeRequest({'id': f"permission-{body.get('emailAddress')}"})
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(callback)
+
+
+# Fake credentials object accepted by the patched gspread.authorize and build
+class FakeCredentials:
+    @classmethod
+    def from_json_keyfile_name(cls, *args, **kwargs):
+        return cls()
+
+
+if __name__ == '__main__':
+    sys.exit(serve())
@@ -1,66 +1,73 @@
 import os
+import sys
+import json
+import hashlib
+import argparse
 import requests
 import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import contextvars
 import logging
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Shared'))
+from ironsource_client import get_client
+from parallel_fetch import fetch_platforms
+from stats_warehouse import get_warehouse
+from request_scheduler import scheduled
+from run_metrics import stage, flush
+from profiling import run_profiled
+from run_summary import step_status, add_rows, add_link
+from sheet_writer import ensure_rows
+from app_config import load_apps, apps_by_tab
+from rolling_stats import record_and_report, app_observations
+from sinks import write_output, sheets_enabled
+from checkpoint import Checkpoint
+from google_clients import open_spreadsheet
+
 # Load environment variables from .env file
 load_dotenv()
 
 # Fetch environment variables
-secret_key = os.getenv('IRONSOURCE_SECRET_KEY')
-refresh_token = os.getenv('IRONSOURCE_REFRESH_TOKEN')
 sheet_id = os.getenv('GOOGLE_SHEET_DAILY_ID')
 credentials_file = 'WaterfallBot/google-credentials.json'
-app_key_ios = os.getenv('IRONSOURCE_APP_KEY_IOS')
-app_key_android = os.getenv('IRONSOURCE_APP_KEY_ANDROID')
 sheet_url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/edit"
 
-# Path to the summary file in the Summary folder
-summary_file_path = 'Summary/summary.txt'
+# Progress of an interrupted backfill, so a re-run can resume from the last completed window
+backfill_state_path = '.cache/dailyrev_backfill.json'
+
+# Upsert mode: update rows in place by (date, app) instead of appending, re-fetching the trailing days IronSource may revise
+upsert_enabled = os.getenv('DAILYREV_UPSERT', '1') != '0'
+revise_days = int(os.getenv('DAILYREV_REVISE_DAYS', '3'))
+
+# (date, app) -> row number map of every tab and the hash of every row this script last wrote.
+# The map is checked against a read of the tab's tail, so the history above it is never downloaded,
+# and unchanged rows are skipped without reading them back.
+row_index_path = '.cache/dailyrev_rows.json'
+
+# Day zero of Sheets date serial numbers
+SHEETS_EPOCH = datetime(1899, 12, 30).date()
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Function to get Bearer Token with GET request
-def get_bearer_token():
-    try:
-        url = "https://platform.ironsrc.com/partners/publisher/auth"
-        headers = {
-            "secretKey": secret_key,
-            "refreshToken": refresh_token
-        }
-        
-        # Request token from IronSource
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()  # Raise an error if the request fails
-        bearer_token = response.text.strip('"')  # Extract and return the Bearer token
-        logging.info("Successfully retrieved Bearer token.")
-        return bearer_token
-    except requests.RequestException as e:
-        logging.error(f"Failed to get Bearer Token: {e}")
-        raise
-
 # Function to connect to Google Sheets
 def connect_to_google_sheets(sheet_id, credentials_file):
     try:
-        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        creds = ServiceAccountCredentials.from_json_keyfile_name(credentials_file, scope)
-        client = gspread.authorize(creds)
-        sheet = client.open_by_key(sheet_id)
+        sheet = open_spreadsheet(sheet_id, credentials_file)
         logging.info("Successfully connected to Google Sheets.")
         return sheet
     except Exception as e:
         logging.error(f"Failed to connect to Google Sheets: {e}")
         raise
 
-# Function to fetch date from M1 in "Raw Data" tab
-def get_date_from_sheet(sheet):
+# Function to fetch date from M1 in the "Raw Data" tab, or another tab with the same layout
+def get_date_from_sheet(sheet, tab_name="Raw Data"):
     try:
-        worksheet = sheet.worksheet("Raw Data")
-        date_str = worksheet.acell('M1').value
+        with stage(f'sheets.read:{tab_name}'):
+            worksheet = scheduled('sheets', sheet.worksheet, tab_name)
+            date_str = scheduled('sheets', worksheet.acell, 'M1').value
         
         # Check if the cell is empty
         if not date_str:
@@ -74,7 +81,7 @@ def get_date_from_sheet(sheet):
         except ValueError:
             raise ValueError(f"Failed to parse date from M1: {date_str} (expected format MM/DD/YYYY)")
     except gspread.exceptions.WorksheetNotFound:
-        logging.error(f"Worksheet 'Raw Data' not found.")
+        logging.error(f"Worksheet '{tab_name}' not found.")
         raise
     except Exception as e:
         logging.error(f"Failed to retrieve date from sheet: {e}")
@@ -83,114 +90,464 @@ def get_date_from_sheet(sheet):
 # Function to pull data from IronSource API
 def fetch_ironsource_data(app_key, start_date, end_date):
     try:
-        bearer_token = get_bearer_token()
-        url = f"https://platform.ironsrc.com/partners/publisher/mediation/applications/v6/stats"
-        
-        params = {
-            'startDate': start_date,
-            'endDate': end_date,
-            'appKey': app_key,
-            'metrics': 'revenue,eCPM,appFillRate,appRequests,impressions,activeUsers,engagedUsers,revenuePerActiveUser,revenuePerEngagedUser',
-            'breakdowns': 'date,app'
-        }
-        
-        headers = {"Authorization": f"Bearer {bearer_token}"}
+        metrics = 'revenue,eCPM,appFillRate,appRequests,impressions,activeUsers,engagedUsers,revenuePerActiveUser,revenuePerEngagedUser'
+        breakdowns = 'date,app'
         
-        response = requests.get(url, headers=headers, params=params)
-        response.raise_for_status()  # Raise an error if the request fails
-        data = response.json()
+        data = get_warehouse().fetch(get_client().iter_stats, app_key, start_date, end_date, breakdowns, metrics)
         
-        logging.info(f"Data returned for app key {app_key}: {data}")
+        # Only the size at INFO; the full payload is formatted lazily and only at DEBUG
+        logging.info("Data returned for app key %s: %d rows", app_key, len(data))
+        logging.debug("Data returned for app key %s: %s", app_key, data)
         return data
     except requests.RequestException as e:
         logging.error(f"Failed to fetch IronSource data: {e}")
         raise
 
-# Function to insert data into Google Sheets
-def insert_data_to_sheet(worksheet, data, platform_name):
+# Function to turn IronSource entries for one platform into sheet rows
+def format_rows(data, platform_name):
+    rows = []
+
+    # Iterate over the list of data entries
+    for entry in data:
+        date_str = entry.get('date', '').strip("'")  # Ensure no single quotes
+
+        # Convert date to the desired YYYY-MM-DD format
+        try:
+            date_formatted = datetime.strptime(date_str, "%Y-%m-%d").strftime("%Y-%m-%d")
+        except ValueError:
+            logging.error(f"Date format is incorrect for {date_str}. Skipping.")
+            continue  # Skip this entry if the date format is incorrect
+
+        metrics = entry.get('data', {})
+        if isinstance(metrics, list):  # If 'data' is a list, iterate over its items
+            for metric in metrics:
+                rows.append([
+                    date_formatted,  # Properly formatted date
+                    f"{entry.get('appName', '')} ({platform_name})".replace(f"({platform_name}) ({platform_name})", f"({platform_name})"),  # Ensure no double platform tag
+                    metric.get('revenue', 0),
+                    metric.get('eCPM', 0),
+                    metric.get('appFillRate', 0),
+                    metric.get('appRequests', 0),
+                    metric.get('impressions', 0),
+                    metric.get('activeUsers', 0),  # DAU
+                    metric.get('engagedUsers', 0),  # DEU
+                    metric.get('revenuePerActiveUser', 0),  # ARPDAU
+                    metric.get('revenuePerEngagedUser', 0)  # ARPDEU
+                ])
+        else:
+            logging.warning(f"Unexpected format for 'data' in entry: {entry}")
+
+    return rows
+
+# Column names of the rows built by format_rows, for the local sinks
+DAILY_HEADER = ['Date', 'App', 'Revenue', 'eCPM', 'Fill Rate', 'Requests', 'Impressions', 'DAU', 'DEU', 'ARPDAU', 'ARPDEU']
+# The metrics are raw JSON numbers, an int in one response and a float in the next, so local sinks store them all as floats
+DAILY_KINDS = {column: 'float' for column in DAILY_HEADER[2:]}
+
+# Function to build the rows of every app, keeping the apps in the order they were given.
+# platform_data is keyed by app name; platforms maps an app name to the platform tag of its rows.
+def build_rows(platform_data, platforms=None):
+    with stage('transform') as record:
+        rows = []
+        for name, data in platform_data.items():
+            rows.extend(format_rows(data, (platforms or {}).get(name, name)))
+        record['rows'] = len(rows)
+    return rows
+
+# Function to insert rows into Google Sheets with a single append
+def insert_data_to_sheet(worksheet, rows):
     try:
-        next_row = len(worksheet.get_all_values()) + 1  # Get the next available row
+        # values.append locates the end of the table server-side, so the existing history is never downloaded.
+        # USER_ENTERED makes Sheets treat the date column as a date.
+        if rows:
+            with stage(f'sheets.append:{worksheet.title}', rows=len(rows)):
+                scheduled('sheets', worksheet.append_rows, rows, value_input_option="USER_ENTERED", idempotent=False)
 
-        # Iterate over the list of data entries
-        for entry in data:
-            date_str = entry.get('date', '').strip("'")  # Ensure no single quotes
+        logging.info(f"Data successfully inserted into '{worksheet.title}' ({len(rows)} rows)")
+    except Exception as e:
+        logging.error(f"Failed to insert data to sheet: {e}")
+        raise
 
-            # Convert date to the desired YYYY-MM-DD format
-            try:
-                date_formatted = datetime.strptime(date_str, "%Y-%m-%d").strftime("%Y-%m-%d")
-            except ValueError:
-                logging.error(f"Date format is incorrect for {date_str}. Skipping.")
-                continue  # Skip this entry if the date format is incorrect
-
-            metrics = entry.get('data', {})
-            if isinstance(metrics, list):  # If 'data' is a list, iterate over its items
-                for metric in metrics:
-                    formatted_row = [
-                        date_formatted,  # Properly formatted date
-                        f"{entry.get('appName', '')} ({platform_name})".replace(f"({platform_name}) ({platform_name})", f"({platform_name})"),  # Ensure no double platform tag
-                        metric.get('revenue', 0),
-                        metric.get('eCPM', 0),
-                        metric.get('appFillRate', 0),
-                        metric.get('appRequests', 0),
-                        metric.get('impressions', 0),
-                        metric.get('activeUsers', 0),  # DAU
-                        metric.get('engagedUsers', 0),  # DEU
-                        metric.get('revenuePerActiveUser', 0),  # ARPDAU
-                        metric.get('revenuePerEngagedUser', 0)  # ARPDEU
-                    ]
-                    
-                    # Insert row into Google Sheets with USER_ENTERED option to treat date as a date
-                    worksheet.append_row(formatted_row, value_input_option="USER_ENTERED")
-                    next_row += 1  # Move to the next row
+# Function to turn a column A cell into a YYYY-MM-DD key; None for the header or anything that is not a date
+def parse_key_date(value):
+    if isinstance(value, (int, float)):
+        return (SHEETS_EPOCH + timedelta(days=int(value))).strftime('%Y-%m-%d')  # UNFORMATTED_VALUE returns dates as serial numbers
+    for date_format in ('%Y-%m-%d', '%m/%d/%Y'):
+        try:
+            return datetime.strptime(str(value), date_format).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    return None
+
+# Function to hash a row exactly as it is written to the sheet
+def row_hash(row):
+    return hashlib.sha1(json.dumps(row).encode('utf-8')).hexdigest()
+
+# Function to turn the column A:B cells of a row into its "date|app" key; None for the header or a row without a date
+def row_key(cells):
+    if len(cells) < 2:
+        return None
+    date_key = parse_key_date(cells[0])
+    return f"{date_key}|{cells[1]}" if date_key is not None else None
+
+# Function to read columns A:B from first_row down
+def read_keys(worksheet, first_row=1):
+    with stage(f'sheets.read:{worksheet.title}') as record:
+        keys = scheduled('sheets', worksheet.get, f'A{first_row}:B', value_render_option='UNFORMATTED_VALUE')
+        record['rows'] = len(keys)
+    return keys
+
+# Function to add the keys read from first_row down to the index; the first row of each key is the one kept up to date
+def index_keys(index, keys, first_row=1):
+    duplicates = 0
+    for row_number, cells in enumerate(keys, start=first_row):
+        key = row_key(cells)
+        if key is None:
+            continue
+        if index.get(key, row_number) != row_number:
+            duplicates += 1  # Left by earlier appends
+            continue
+        index[key] = row_number
+    return duplicates
+
+# Function to check the tail read from first_row down against the cached index: every cached row must still hold its key
+# and no unknown key may sit above the cached end of the table, or rows were inserted or deleted since the last run
+def tail_matches(cached_index, cached_last_row, keys, first_row):
+    if first_row + len(keys) - 1 < cached_last_row:
+        return False
+    keys_by_row = {row_number: key for key, row_number in cached_index.items() if row_number >= first_row}
+    for row_number, cells in enumerate(keys, start=first_row):
+        key = row_key(cells)
+        expected = keys_by_row.get(row_number)
+        if expected is not None and key != expected:
+            return False
+        if expected is None and key is not None and row_number <= cached_last_row and key not in cached_index:
+            return False
+    return True
+
+# Function to build the (date, app) -> row number map of the tab and its last row.
+# With a cached map, only the rows from the first one being written down are read; a full read of columns A:B
+# is the fallback when there is no cache or the tail no longer matches it.
+def read_row_index(worksheet, rows, cached):
+    cached_index = cached.get('index')
+    if cached_index:
+        cached_last_row = cached['last_row']
+        first_row = min((cached_index[f"{row[0]}|{row[1]}"] for row in rows if f"{row[0]}|{row[1]}" in cached_index),
+                        default=cached_last_row)
+        keys = read_keys(worksheet, first_row)
+        if tail_matches(cached_index, cached_last_row, keys, first_row):
+            index = dict(cached_index)
+            index_keys(index, keys, first_row)
+            return index, first_row + len(keys) - 1
+        logging.info(f"{worksheet.title} changed since the last run, reading all of its rows")
+
+    keys = read_keys(worksheet)
+    index = {}
+    duplicates = index_keys(index, keys)
+    if duplicates:
+        logging.warning(f"{worksheet.title} has {duplicates} duplicate (date, app) rows; only the first of each is updated")
+    return index, len(keys)
+
+# Function to load the cached row maps of every tab of this sheet
+def load_all_row_caches():
+    try:
+        with open(row_index_path, 'r') as file:
+            cached = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    if cached.get('sheet_id') != sheet_id or cached.get('version') != 2:
+        return {}
+    return cached.get('tabs', {})
+
+# Function to load the row map and row hashes of the last upsert into one tab
+def load_row_cache(tab_name):
+    return load_all_row_caches().get(tab_name, {})
+
+# Function to save the row map and row hashes of one tab, replacing the file atomically
+def save_row_cache(tab_name, index, last_row, hashes):
+    tabs = load_all_row_caches()
+    tabs[tab_name] = {'index': index, 'last_row': last_row, 'hashes': hashes}
+    os.makedirs(os.path.dirname(row_index_path), exist_ok=True)
+    temp_path = row_index_path + '.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump({'version': 2, 'sheet_id': sheet_id, 'tabs': tabs}, file)
+    os.replace(temp_path, row_index_path)
+
+# Function to upsert rows: rewrite the rows whose values changed and append new keys, in one batched call
+def upsert_data_to_sheet(worksheet, rows):
+    try:
+        cached = load_row_cache(worksheet.title)
+        index, last_row = read_row_index(worksheet, rows, cached)
+
+        # A cached hash only counts when its key is still on the same row
+        hashes = {key: entry for key, entry in cached.get('hashes', {}).items() if index.get(key) == entry[0]}
+
+        changed = {}  # Row number -> row to write
+        appended = 0
+        for row in rows:
+            key = f"{row[0]}|{row[1]}"
+            digest = row_hash(row)
+            row_number = index.get(key)
+            if row_number is None:
+                # New key: goes on the first free row below the table
+                last_row += 1
+                row_number = index[key] = last_row
+                appended += 1
+            elif key in hashes and hashes[key][1] == digest:
+                continue  # Unchanged since the last run
+            changed[row_number] = row
+            hashes[key] = [row_number, digest]
+
+        # Group consecutive row numbers into one range each
+        updates = []
+        for row_number in sorted(changed):
+            if updates and updates[-1]['last'] == row_number - 1:
+                updates[-1]['values'].append(changed[row_number])
+                updates[-1]['last'] = row_number
             else:
-                logging.warning(f"Unexpected format for 'data' in entry: {entry}")
+                updates.append({'first': row_number, 'last': row_number, 'values': [changed[row_number]]})
+        updates = [{'range': f"A{update['first']}:K{update['last']}", 'values': update['values']} for update in updates]
+
+        if updates:
+            with stage(f'sheets.write:{worksheet.title}', rows=len(changed)):
+                ensure_rows(worksheet, last_row)
+                # USER_ENTERED makes Sheets treat the date column as a date, as the append did
+                scheduled('sheets', worksheet.batch_update, updates, value_input_option='USER_ENTERED')
+        save_row_cache(worksheet.title, index, last_row, hashes)
 
-        logging.info(f"Data successfully inserted for {platform_name}")
+        logging.info(f"Upserted '{worksheet.title}': {len(changed) - appended} rows updated, {appended} appended, "
+                     f"{len(rows) - len(changed)} unchanged")
     except Exception as e:
-        logging.error(f"Failed to insert data to sheet: {e}")
+        logging.error(f"Failed to upsert data to sheet: {e}")
         raise
 
-# Main execution flow with summary and error logging
-if __name__ == '__main__':
+# Function to split a date range into consecutive windows of window_days
+def split_windows(start_date, end_date, window_days):
+    windows = []
+    window_start = start_date
+    while window_start <= end_date:
+        window_end = min(window_start + timedelta(days=window_days - 1), end_date)
+        windows.append((window_start.strftime('%Y-%m-%d'), window_end.strftime('%Y-%m-%d')))
+        window_start = window_end + timedelta(days=1)
+    return windows
+
+# Function to load the saved windows of a backfill over the same range
+def load_backfill_state(start_date_str, end_date_str):
     try:
-        # Connect to Google Sheets
-        sheet = connect_to_google_sheets(sheet_id, credentials_file)
-        
+        with open(backfill_state_path, 'r') as file:
+            state = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    if state.get('from') != start_date_str or state.get('to') != end_date_str:
+        logging.info("Saved backfill state is for a different range. Starting over.")
+        return {}
+    return state.get('windows', {})
+
+# Function to save the completed windows, replacing the file atomically
+def save_backfill_state(start_date_str, end_date_str, windows):
+    os.makedirs(os.path.dirname(backfill_state_path), exist_ok=True)
+    temp_path = backfill_state_path + '.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump({'from': start_date_str, 'to': end_date_str, 'windows': windows}, file)
+    os.replace(temp_path, backfill_state_path)
+
+# Function to fetch a long date range in windows, in parallel, and merge the results in date order
+def backfill(app_keys, start_date, end_date, window_days=7, max_workers=4, resume=False):
+    start_date_str = start_date.strftime('%Y-%m-%d')
+    end_date_str = end_date.strftime('%Y-%m-%d')
+    windows = split_windows(start_date, end_date, window_days)
+    completed = load_backfill_state(start_date_str, end_date_str) if resume else {}
+
+    # Every (window, platform) pair that has not been fetched yet
+    pending = [(f"{window_start}:{window_end}", platform)
+               for window_start, window_end in windows
+               for platform in app_keys
+               if platform not in completed.get(f"{window_start}:{window_end}", {})]
+    logging.info(f"Backfilling {start_date_str} to {end_date_str}: {len(windows)} windows, {len(pending)} fetches pending")
+
+    failures = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(contextvars.copy_context().run, run_profiled, fetch_ironsource_data, app_keys[platform], *window.split(':')): (window, platform)
+            for window, platform in pending
+        }
+        for future in as_completed(futures):
+            window, platform = futures[future]
+            try:
+                completed.setdefault(window, {})[platform] = future.result()
+            except Exception as e:
+                logging.error(f"Failed to fetch {platform} {window}: {type(e).__name__}: {e}")
+                failures.append(f"{platform} {window}")
+                continue
+            save_backfill_state(start_date_str, end_date_str, completed)
+
+    if failures:
+        raise RuntimeError(f"Backfill incomplete, re-run with --resume. Failed windows: {', '.join(sorted(failures))}")
+
+    # Merge each platform's windows in date order
+    return {
+        platform: [entry for window_start, window_end in windows for entry in completed[f"{window_start}:{window_end}"][platform]]
+        for platform in app_keys
+    }
+
+# Function to check that a count option is at least 1
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+# Function to parse the command line options
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Insert IronSource daily revenue into the Raw Data tab")
+    parser.add_argument('--from', dest='from_date', help="Backfill start date (YYYY-MM-DD). Defaults to the day after M1.")
+    parser.add_argument('--to', dest='to_date', help="Backfill end date (YYYY-MM-DD). Defaults to yesterday.")
+    parser.add_argument('--window-days', type=positive_int, default=7, help="Days per backfill request")
+    parser.add_argument('--max-workers', type=positive_int, default=4, help="Concurrent backfill requests")
+    parser.add_argument('--resume', action='store_true', help="Reuse the windows completed by an interrupted backfill")
+    parser.add_argument('--revise-days', type=int, default=revise_days,
+                        help="Trailing days to re-fetch and update in place in upsert mode (DAILYREV_UPSERT=1)")
+    parser.add_argument('--profile', action='store_true',
+                        help="Save cProfile and tracemalloc reports of every stage to Summary/profiles (same as RUN_PROFILE=1)")
+    return parser.parse_args(argv)
+
+# Function to add the fetched days to each app's rolling statistics, reporting revenue, eCPM or fill rate drops in the summary
+def record_app_stats(platform_data, platforms):
+    with stage('anomalies') as record:
+        observations = (observation for name, data in platform_data.items() for observation in app_observations(data, platforms.get(name, name)))
+        record['anomalies'] = len(record_and_report('app', observations, 'dailyrev'))
+
+# Function to write rows to a tab, upserting or appending
+def write_sheet_tab(sheet, tab_name, rows):
+    worksheet = scheduled('sheets', sheet.worksheet, tab_name)
+    if upsert_enabled:
+        upsert_data_to_sheet(worksheet, rows)
+    else:
+        insert_data_to_sheet(worksheet, rows)
+
+# Function to write the fetched data of one tab's apps to every sink selected in OUTPUT_SINKS.
+# Local sinks append; the SQLite sink replaces rows with the same (date, app).
+# The built rows and the write are checkpointed under stage_key, so a re-run never appends them twice.
+def write_tab(sheet, tab_name, platform_data, platforms, checkpoint, stage_key):
+    if checkpoint.done(f'write:{stage_key}'):
+        logging.info(f"'{tab_name}' was already written in this run")
+        return
+    rows = checkpoint.run(f'transform:{stage_key}', build_rows, platform_data, platforms)
+    write_output('dailyrev', tab_name, DAILY_HEADER, lambda: iter(rows), lambda: write_sheet_tab(sheet, tab_name, rows),
+                 mode='append', key=('Date', 'App'), kinds=DAILY_KINDS)
+    checkpoint.complete(f'write:{stage_key}')
+    add_rows('dailyrev', len(rows))
+
+# Function to bring one tab up to date from the day after its M1 date; returns whether anything was written.
+# Without the Sheets sink there is no M1, so only the trailing --revise-days days are fetched.
+def update_tab(sheet, tab_name, tab_apps, args, yesterday, checkpoint):
+    if sheet is not None:
         # Get the date from M1
-        m1_date = get_date_from_sheet(sheet)
+        m1_date = get_date_from_sheet(sheet, tab_name)
 
         # Calculate the date range: Start from the day after M1's date until yesterday
         start_date = m1_date + timedelta(days=1)
+    else:
+        start_date = yesterday - timedelta(days=max(1, args.revise_days) - 1)
+    end_date = yesterday
+
+    # In upsert mode also re-fetch the trailing days, whose revenue IronSource may still revise
+    if upsert_enabled and args.revise_days > 0:
+        start_date = min(start_date, yesterday - timedelta(days=args.revise_days - 1))
+
+    # If start_date is after the end date, log that the data is already up to date
+    if start_date > end_date:
+        logging.info(f"'{tab_name}' is already up to date until {end_date}. No new data to fetch.")
+        return False
+
+    app_keys = {app['name']: app['app_key'] for app in tab_apps}
+    with stage('fetch') as record:
+        # Format dates to YYYY-MM-DD for the API request
+        start_date_str = start_date.strftime('%Y-%m-%d')
+        end_date_str = end_date.strftime('%Y-%m-%d')
+
+        # Fetch every app of the tab from IronSource concurrently
+        platform_data = fetch_platforms(checkpoint.fetcher(fetch_ironsource_data), app_keys, start_date_str, end_date_str)
+
+        # Only insert when every app succeeded, otherwise M1 would move past the missing data
+        missing = [name for name in app_keys if name not in platform_data]
+        if missing:
+            raise RuntimeError(f"Failed to fetch IronSource data for {', '.join(missing)}")
+        record['rows'] = sum(len(data) for data in platform_data.values())
+
+    # Insert data into the Google Sheet
+    platforms = {app['name']: app['platform'] for app in tab_apps}
+    write_tab(sheet, tab_name, platform_data, platforms, checkpoint, f'{tab_name}:{start_date_str}:{end_date_str}')
+    record_app_stats(platform_data, platforms)
+    return True
+
+# Main execution flow with summary and error logging
+def main(args):
+    try:
+        # Connect to Google Sheets, unless this run only writes local sinks
+        sheet = connect_to_google_sheets(sheet_id, credentials_file) if sheets_enabled('dailyrev') else None
+        
+        apps = load_apps('dailyrev')
+        tabs = apps_by_tab(apps, 'dailyrev', "Raw Data")
+        platforms = {app['name']: app['platform'] for app in apps}
         yesterday = datetime.now().date() - timedelta(days=1)
+        written = False
+        failures = []
 
-        # If start_date is after yesterday, log that the data is already up to date
-        if start_date > yesterday:
-            logging.info(f"Data is already up to date until {yesterday}. No new data to fetch.")
-        else:
-            # Format dates to YYYY-MM-DD for the API request
-            start_date_str = start_date.strftime('%Y-%m-%d')
-            end_date_str = yesterday.strftime('%Y-%m-%d')
+        # A re-run of a failed run reuses its completed fetches and skips the tabs it already wrote
+        checkpoint = Checkpoint('dailyrev')
 
-            # Fetch iOS and Android data from IronSource
-            ios_data = fetch_ironsource_data(app_key_ios, start_date_str, end_date_str)
-            android_data = fetch_ironsource_data(app_key_android, start_date_str, end_date_str)
+        if args.from_date:
+            # Backfill mode: explicit range, fetched in parallel windows for every app at once
+            start_date = datetime.strptime(args.from_date, '%Y-%m-%d').date()
+            end_date = datetime.strptime(args.to_date, '%Y-%m-%d').date() if args.to_date else yesterday
 
-            # Insert data into the Google Sheet
-            worksheet = sheet.worksheet("Raw Data")
-            insert_data_to_sheet(worksheet, ios_data, "iOS")
-            insert_data_to_sheet(worksheet, android_data, "Android")
+            if start_date > end_date:
+                logging.info(f"Backfill range {start_date} to {end_date} is empty. No data to fetch.")
+            else:
+                with stage('fetch') as record:
+                    platform_data = backfill({app['name']: app['app_key'] for app in apps}, start_date, end_date,
+                                             args.window_days, args.max_workers, args.resume)
+                    record['rows'] = sum(len(data) for data in platform_data.values())
+
+                # One write per tab
+                for tab_name, tab_apps in tabs.items():
+                    write_tab(sheet, tab_name, {app['name']: platform_data[app['name']] for app in tab_apps}, platforms,
+                              checkpoint, f'{tab_name}:{start_date}:{end_date}')
+                record_app_stats(platform_data, platforms)
+                written = True
 
-            # Generate the summary for this script with a single hyperlink
-            summary = f"<{sheet_url}|Performance>"
+                # The backfill has been written, so its saved progress is no longer needed
+                if os.path.exists(backfill_state_path):
+                    os.remove(backfill_state_path)
+        else:
+            # Each tab has its own M1 date; a failing tab does not stop the others
+            for tab_name, tab_apps in tabs.items():
+                try:
+                    written = update_tab(sheet, tab_name, tab_apps, args, yesterday, checkpoint) or written
+                except Exception as e:
+                    logging.error(f"Failed to update '{tab_name}': {e}")
+                    failures.append(f"{tab_name}: {e}")
 
-            # Append the summary to the Summary/summary.txt file without duplicate "Performance"
-            with open(summary_file_path, 'a') as file:
-                file.write(summary + '\n')
+        if written and sheet is not None:
+            # Link the sheet in the Slack summary
+            add_link('dailyrev', 'Performance', sheet_url)
+
+        if failures:
+            raise RuntimeError('; '.join(failures))
+        checkpoint.finish()
 
     except Exception as e:
-        error_message = f"Error in dailyrev.py: {str(e)}"
-        logging.error(error_message)
-        
-        # Log the error in the Summary/summary.txt file
-        with open(summary_file_path, 'a') as file:
-            file.write(f"{error_message}\n")
+        logging.error(f"Error in dailyrev.py: {str(e)}")
+
+        # Let the caller record the failure in the run summary
+        raise
+
+if __name__ == '__main__':
+    try:
+        with step_status('dailyrev'):  # Record the outcome for the Slack summary
+            main(parse_args())
+    except Exception:
+        pass  # Already logged and recorded in Summary/run_summary.json
+    finally:
+        flush('dailyrev')  # Record stage timings and API counts in Summary/metrics.json
@@ -0,0 +1,112 @@
+import os
+import sys
+import time
+import logging
+import contextvars
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Shared'))
+from run_metrics import script_section, flush
+from run_summary import step_status, set_status
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Steps of the daily run as (script, steps it waits for, how to call it).
+# waterfall waits for fillrate so that it reads their shared IronSource query from the warehouse.
+STEPS = {
+    'fillrate': ('WaterfallBot/PlacementFillRate/fillrate.py', [], lambda module: module.main()),
+    'waterfall': ('WaterfallBot/Waterfall/waterfall.py', ['fillrate'], lambda module: module.main()),
+    'duplicate': ('WaterfallBot/duplicate.py', [], lambda module: module.main()),
+    'dailyrev': ('Daily-Rev/dailyrev.py', [], lambda module: module.main(module.parse_args([]))),
+}
+
+# The Slack summary runs last and reports on every other step
+SUMMARY_SCRIPT = 'Summary/slack_message.py'
+
+# Upper bound on steps running at the same time
+max_workers = int(os.getenv('ORCHESTRATOR_MAX_WORKERS', '4'))
+
+
+# Import a script by path without running its __main__ block
+def load_script(name, path):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(REPO_ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Run one step, recording its metrics under its own name, and return its status
+def run_step(name, module, call):
+    started = time.perf_counter()
+    with script_section(name):
+        try:
+            with step_status(name):  # Record the outcome for the Slack summary
+                call(module)
+            status = {'status': 'ok'}
+        except Exception as e:
+            logging.exception(f"Step {name} failed")
+            status = {'status': 'error', 'error': f"{type(e).__name__}: {e}"}
+        finally:
+            flush(name)  # Record stage timings and API counts in Summary/metrics.json
+    status['seconds'] = round(time.perf_counter() - started, 3)
+    return status
+
+
+# Run every step once all the steps it waits for have finished, successfully or not
+def run_steps(modules, workers=max_workers):
+    results = {}
+    pending = dict(STEPS)
+
+    # Steps whose script failed to import are finished before they start
+    for name in list(pending):
+        if isinstance(modules[name], Exception):
+            results[name] = {'status': 'error', 'error': f"Import failed: {modules[name]}", 'seconds': 0.0}
+            set_status(name, 'error', results[name]['error'])
+            del pending[name]
+
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        while pending or running:
+            for name, (_, after, call) in list(pending.items()):
+                if all(step in results for step in after):
+                    # Each step gets its own copy of the context, so its metrics section stays its own
+                    running[executor.submit(contextvars.copy_context().run, run_step, name, modules[name], call)] = name
+                    del pending[name]
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+    return results
+
+
+def main():
+    # Import every script up front, in this thread, so the steps share one set of clients
+    modules = {}
+    for name, (path, _, _) in STEPS.items():
+        try:
+            modules[name] = load_script(name, path)
+        except Exception as e:
+            logging.error(f"Failed to load {path}: {e}")
+            modules[name] = e
+
+    results = run_steps(modules)
+    for name in STEPS:
+        logging.info(f"{name}: {results[name]['status']} in {results[name]['seconds']:.1f}s")
+
+    # Send the Slack summary, built from what every step recorded in Summary/run_summary.json
+    load_script('slack_message', SUMMARY_SCRIPT).main()
+
+    # Fail the workflow run when any step failed, after the summary has been sent
+    if any(result['status'] != 'ok' for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
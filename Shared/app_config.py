@@ -0,0 +1,49 @@
+import os
+import json
+
+# JSON file listing every app to report on; see apps.example.json. Without it the two env app keys are used.
+apps_config_path = os.getenv('APPS_CONFIG_PATH', 'apps.json')
+
+
+# The two apps configured through the environment, as before the config file existed
+def _default_apps():
+    return [
+        {'name': 'iOS', 'platform': 'iOS', 'app_key': os.getenv('IRONSOURCE_APP_KEY_IOS'), 'tabs': {}},
+        {'name': 'Android', 'platform': 'Android', 'app_key': os.getenv('IRONSOURCE_APP_KEY_ANDROID'), 'tabs': {}},
+    ]
+
+
+# Load the apps from the config file, resolving app_key_env to the key stored in that environment variable
+def load_apps(script=None):
+    if not os.path.exists(apps_config_path):
+        apps = _default_apps()
+    else:
+        with open(apps_config_path, 'r') as file:
+            config = json.load(file)
+        apps = []
+        for entry in config.get('apps', []):
+            app_key = entry.get('app_key') or os.getenv(entry.get('app_key_env', ''))
+            if not app_key:
+                raise ValueError(f"App {entry.get('name') or entry.get('platform')} in {apps_config_path} has no app_key or app_key_env")
+            apps.append({
+                'name': entry.get('name') or entry['platform'],
+                'platform': entry['platform'],
+                'app_key': app_key,
+                'tabs': entry.get('tabs', {})
+            })
+        names = [app['name'] for app in apps]
+        if len(set(names)) != len(names):
+            raise ValueError(f"App names in {apps_config_path} must be unique")
+
+    # An app can leave a script out by setting its tab to null
+    if script is not None:
+        apps = [app for app in apps if app['tabs'].get(script, '') is not None]
+    return apps
+
+
+# Group the apps of a script by the tab they are written to, keeping the config order
+def apps_by_tab(apps, script, default_tab):
+    tabs = {}
+    for app in apps:
+        tabs.setdefault(app['tabs'].get(script) or default_tab, []).append(app)
+    return tabs
@@ -0,0 +1,91 @@
+import os
+import gzip
+import json
+import logging
+import threading
+from urllib.parse import urlsplit, urlencode
+
+import requests
+
+# Cassette file and mode; without a path every request goes to the network as usual.
+# record: always call the API and save the responses
+# replay: serve saved responses only, never touching the network
+# once:   serve saved responses, calling the API and saving only what is missing
+cassette_path = os.getenv('IRONSOURCE_CASSETTE')
+cassette_mode = os.getenv('IRONSOURCE_CASSETTE_MODE', 'once')
+
+MODES = ('record', 'replay', 'once')
+
+
+# Raised in replay mode for a request the cassette does not contain
+class CassetteMiss(requests.RequestException):
+    pass
+
+
+# Key of a request: method, path and sorted query parameters. Headers are left out, so no secret is stored.
+def request_key(method, url, params=None):
+    query = urlencode(sorted((params or {}).items()))
+    return f"{method} {urlsplit(url).path}" + (f"?{query}" if query else '')
+
+
+# Build a requests.Response around a saved body, so callers can read it or stream it like a live one
+def _replayed_response(url, entry):
+    response = requests.Response()
+    response.status_code = entry['status']
+    response.url = url
+    response.headers['Content-Type'] = entry.get('content_type', 'application/json')
+    response.encoding = 'utf-8'
+    response._content = entry['body'].encode('utf-8')
+    response._content_consumed = True  # iter_content then slices the saved body instead of reading a socket
+    return response
+
+
+# gzip-compressed JSON file of successful responses keyed by request_key
+class Cassette:
+    def __init__(self, path=cassette_path, mode=cassette_mode):
+        if mode not in MODES:
+            raise ValueError(f"IRONSOURCE_CASSETTE_MODE must be one of {', '.join(MODES)}, not {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.interactions = {}
+        if mode != 'record' and os.path.exists(path):
+            with gzip.open(path, 'rt', encoding='utf-8') as file:
+                self.interactions = json.load(file).get('interactions', {})
+        logging.info(f"IronSource cassette {path} in {mode} mode ({len(self.interactions)} saved responses)")
+
+    @property
+    def replaying(self):
+        return self.mode == 'replay'
+
+    # Return the saved response for a request, or None when it has to go to the network
+    def play(self, method, url, params=None):
+        key = request_key(method, url, params)
+        entry = self.interactions.get(key)
+        # A redacted response is only good while nothing else goes to the network
+        if entry is not None and (self.mode == 'replay' or (self.mode == 'once' and not entry.get('redacted'))):
+            return _replayed_response(url, entry)
+        if self.mode == 'replay':
+            raise CassetteMiss(f"No saved response for {key} in {self.path}")
+        return None
+
+    # Save a successful live response and return one that can still be read or streamed.
+    # With redact, a placeholder is saved instead of the body, e.g. for a bearer token.
+    def record(self, method, url, params, response, redact=False):
+        if response.status_code != 200:
+            return response
+        entry = {'status': response.status_code, 'content_type': response.headers.get('Content-Type', 'application/json'),
+                 'body': response.content.decode('utf-8')}
+        with self.lock:
+            self.interactions[request_key(method, url, params)] = dict(entry, body='"redacted"', redacted=True) if redact else entry
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            temp_path = f'{self.path}.tmp'
+            with gzip.open(temp_path, 'wt', encoding='utf-8') as file:
+                json.dump({'version': 1, 'interactions': self.interactions}, file)
+            os.replace(temp_path, self.path)
+        return _replayed_response(url, entry)
+
+
+# The cassette configured in the environment, or None
+def cassette_from_env():
+    return Cassette() if cassette_path else None
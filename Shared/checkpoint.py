@@ -0,0 +1,80 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+import logging
+import threading
+
+from run_metrics import run_id
+
+# Completed stages of unfinished runs, one directory per script and run
+checkpoint_dir = os.getenv('CHECKPOINT_DIR', '.cache/checkpoints')
+checkpoints_enabled = os.getenv('RUN_CHECKPOINTS', '1') != '0'
+
+
+# File name for a stage, readable but safe, e.g. "fetch:ios-app:2024-01-02" -> "fetch_ios-app_2024-01-02-<hash>.json"
+def _stage_file(stage_name):
+    digest = hashlib.sha1(stage_name.encode('utf-8')).hexdigest()[:8]
+    return f"{re.sub(r'[^A-Za-z0-9.-]+', '_', stage_name)[:80]}-{digest}.json"
+
+
+# Records every completed stage of one script run, with its payload, so a re-run of the same run resumes after it.
+# The run is identified by GITHUB_RUN_ID, or the date for local runs; finish() removes the checkpoint.
+class Checkpoint:
+    def __init__(self, script, run_key=run_id, enabled=checkpoints_enabled):
+        self.enabled = enabled
+        self.path = os.path.join(checkpoint_dir, f'{script}-{run_key}')
+        self.lock = threading.Lock()
+        if not enabled:
+            return
+
+        # Checkpoints of earlier runs of this script can never be resumed, so drop them
+        if os.path.isdir(checkpoint_dir):
+            for name in os.listdir(checkpoint_dir):
+                if name.startswith(f'{script}-') and name != os.path.basename(self.path):
+                    shutil.rmtree(os.path.join(checkpoint_dir, name), ignore_errors=True)
+        if os.path.isdir(self.path):
+            logging.info(f"Resuming {script} from {len(os.listdir(self.path))} completed stages in {self.path}")
+
+    def done(self, stage_name):
+        return self.enabled and os.path.exists(os.path.join(self.path, _stage_file(stage_name)))
+
+    # Payload saved with a completed stage
+    def get(self, stage_name):
+        with open(os.path.join(self.path, _stage_file(stage_name)), 'r') as file:
+            return json.load(file)['payload']
+
+    # Mark a stage as completed, replacing its file atomically
+    def complete(self, stage_name, payload=None):
+        if not self.enabled:
+            return
+        with self.lock:
+            os.makedirs(self.path, exist_ok=True)
+            path = os.path.join(self.path, _stage_file(stage_name))
+            temp_path = f'{path}.{threading.get_ident()}.tmp'
+            with open(temp_path, 'w') as file:
+                json.dump({'stage': stage_name, 'payload': payload}, file)
+            os.replace(temp_path, path)
+
+    # Return the saved payload of a completed stage, or run fn and save what it returns.
+    # Empty results are not saved, since the fetchers return [] when a request failed.
+    def run(self, stage_name, fn, *args, **kwargs):
+        if self.done(stage_name):
+            logging.info(f"Skipping {stage_name}, completed earlier in this run")
+            return self.get(stage_name)
+        payload = fn(*args, **kwargs)
+        if payload or payload is None:
+            self.complete(stage_name, payload)
+        return payload
+
+    # Wrap fetch(app_key, start_date, end_date) so each fetch is checkpointed
+    def fetcher(self, fetch):
+        def checkpointed(app_key, start_date, end_date):
+            return self.run(f'fetch:{app_key}:{start_date}:{end_date}', fetch, app_key, start_date, end_date)
+        return checkpointed
+
+    # The whole run succeeded, so there is nothing left to resume
+    def finish(self):
+        if self.enabled:
+            shutil.rmtree(self.path, ignore_errors=True)
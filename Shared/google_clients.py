@@ -0,0 +1,71 @@
+import threading
+
+import gspread
+from googleapiclient import discovery
+from oauth2client.service_account import ServiceAccountCredentials
+
+from request_scheduler import scheduled
+from run_metrics import stage
+
+# One scope set covers both Sheets and Drive, so every script can share the same credentials
+SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+
+_lock = threading.Lock()
+_credentials = {}
+_gspread_clients = {}
+_drive_services = {}
+_spreadsheets = {}
+
+
+# Service account credentials, read from the key file once per process
+def get_credentials(credentials_file):
+    with _lock:
+        creds = _credentials.get(credentials_file)
+        if creds is None:
+            creds = _credentials[credentials_file] = ServiceAccountCredentials.from_json_keyfile_name(credentials_file, SCOPE)
+        return creds
+
+
+# Authorized gspread client, shared by every script running in this process
+def get_gspread_client(credentials_file):
+    creds = get_credentials(credentials_file)
+    with _lock:
+        client = _gspread_clients.get(credentials_file)
+        if client is None:
+            client = _gspread_clients[credentials_file] = gspread.authorize(creds)
+        return client
+
+
+# Drive v3 service built from the discovery document bundled with google-api-python-client.
+# The service's httplib2 connection is not thread-safe, so only one thread at a time should use it.
+def get_drive_service(credentials_file):
+    creds = get_credentials(credentials_file)
+    with _lock:
+        service = _drive_services.get(credentials_file)
+        if service is None:
+            service = _drive_services[credentials_file] = discovery.build(
+                'drive', 'v3', credentials=creds, static_discovery=True, cache_discovery=False
+            )
+        return service
+
+
+# Spreadsheet opened by key, so scripts writing to the same spreadsheet open it only once
+def open_spreadsheet(sheet_id, credentials_file):
+    client = get_gspread_client(credentials_file)
+    with _lock:
+        spreadsheet = _spreadsheets.get(sheet_id)
+        if spreadsheet is not None:
+            return spreadsheet
+    with stage('sheets.open'):
+        spreadsheet = scheduled('sheets', client.open_by_key, sheet_id)
+    with _lock:
+        return _spreadsheets.setdefault(sheet_id, spreadsheet)
+
+
+# Forget every cached client, e.g. between benchmark scenarios
+def reset():
+    with _lock:
+        _credentials.clear()
+        _gspread_clients.clear()
+        _drive_services.clear()
+        _spreadsheets.clear()
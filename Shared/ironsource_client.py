@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import base64
+import codecs
+import hashlib
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from request_scheduler import scheduled_request
+from run_metrics import stage, count
+from cassette import cassette_from_env
+
+# IronSource endpoints; the base URL can point at a local stand-in for benchmarks
+base_url = os.getenv('IRONSOURCE_BASE_URL', 'https://platform.ironsrc.com')
+AUTH_URL = f"{base_url}/partners/publisher/auth"
+STATS_URL = f"{base_url}/partners/publisher/mediation/applications/v6/stats"
+
+# Bearer tokens are valid for 60 minutes; refresh a little early to be safe
+DEFAULT_TOKEN_LIFETIME = 55 * 60
+TOKEN_EXPIRY_MARGIN = 60
+
+# Token cache file, relative to the repository root like the other paths in this project
+token_cache_path = os.getenv('IRONSOURCE_TOKEN_CACHE', '.cache/ironsource_token.json')
+
+
+# Read the expiry time from the JWT payload, falling back to the default lifetime
+def _token_expiry(token):
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))['exp'])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return time.time() + DEFAULT_TOKEN_LIFETIME
+
+
+# Yield the elements of a top-level JSON array as the text arrives, without holding the whole body
+def iter_json_array(chunks):
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    for chunk in chunks:
+        buffer += chunk
+        pos = 0
+        while True:
+            # Skip whitespace and the commas between elements
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError(f"Expected a JSON array, got {buffer[pos:pos + 80]!r}")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                return
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                break  # The element is not complete yet, wait for the next chunk
+            yield item
+        buffer = buffer[pos:]
+    # The closing bracket returns above, so getting here means the body was cut short
+    raise ValueError("Truncated JSON array in IronSource response")
+
+
+# IronSource client sharing one bearer token and one keep-alive HTTP session per process.
+# With a cassette, auth and stats responses are recorded to or replayed from it.
+class IronSourceClient:
+    def __init__(self, secret_key, refresh_token, cache_path=token_cache_path, cassette=None):
+        self.secret_key = secret_key
+        self.refresh_token = refresh_token
+        self.cache_path = cache_path
+        self.cassette = cassette
+        # Identify the credentials so a cached token is never reused for another account
+        self.cache_key = hashlib.sha256(f"{secret_key}:{refresh_token}".encode()).hexdigest()[:16]
+        self._token = None
+        self._expires_at = 0
+        self._lock = threading.Lock()
+
+        self.session = requests.Session()
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate"})
+        self.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+    # Load a still-valid token from the on-disk cache
+    def _load_cached_token(self):
+        try:
+            with open(self.cache_path, 'r') as file:
+                cached = json.load(file)
+        except (OSError, ValueError):
+            return False
+        if cached.get('key') != self.cache_key or cached.get('expires_at', 0) - TOKEN_EXPIRY_MARGIN <= time.time():
+            return False
+        self._token = cached['token']
+        self._expires_at = cached['expires_at']
+        return True
+
+    # Save the current token so the next script in the run can reuse it
+    def _save_cached_token(self):
+        if self.cassette is not None and self.cassette.replaying:
+            return  # A replayed token is only good for the cassette
+        try:
+            os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+            fd = os.open(self.cache_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as file:
+                json.dump({'key': self.cache_key, 'token': self._token, 'expires_at': self._expires_at}, file)
+        except OSError as e:
+            logging.warning(f"Could not write IronSource token cache: {e}")
+
+    # Send a GET through the request scheduler, or serve it from the cassette when it has the response.
+    # Recording reads the whole body, so a recorded response is streamed from memory.
+    # Bearer tokens are never written to the cassette; replay ignores the Authorization header anyway.
+    def _send(self, url, headers, params=None, stream=False):
+        if self.cassette is None:
+            return scheduled_request('ironsource', self.session.get, url, headers=headers, params=params, stream=stream)
+        response = self.cassette.play('GET', url, params)
+        if response is None:
+            live = scheduled_request('ironsource', self.session.get, url, headers=headers, params=params)
+            response = self.cassette.record('GET', url, params, live, redact=url == AUTH_URL)
+        return response
+
+    # Request a fresh Bearer token from IronSource
+    def _request_token(self):
+        headers = {
+            "secretKey": self.secret_key,
+            "refreshToken": self.refresh_token
+        }
+        try:
+            with stage('auth'):
+                response = self._send(AUTH_URL, headers)
+                response.raise_for_status()  # Raise an error if the request fails
+        except requests.RequestException as e:
+            logging.error(f"Failed to get Bearer Token: {e}")
+            raise
+        self._token = response.text.strip('"')  # Extract the Bearer token
+        self._expires_at = _token_expiry(self._token)
+        self._save_cached_token()
+        logging.info("Successfully retrieved Bearer token.")
+
+    # Return a valid Bearer token, using the memory and disk caches when possible
+    def get_bearer_token(self, force_refresh=False):
+        with self._lock:
+            if force_refresh:
+                self._request_token()
+            elif self._token and self._expires_at - TOKEN_EXPIRY_MARGIN > time.time():
+                pass
+            elif not self._load_cached_token():
+                self._request_token()
+            return self._token
+
+    # GET an authenticated IronSource endpoint, refreshing the token once on a 401.
+    # A response saved in the cassette needs no token, so replay never authenticates
+    # and once mode only does when a request has to go to the network.
+    def get(self, url, params=None, stream=False):
+        if self.cassette is not None:
+            response = self.cassette.play('GET', url, params)
+            if response is not None:
+                response.raise_for_status()
+                return response
+        token = self.get_bearer_token()
+        response = self._send(url, {"Authorization": f"Bearer {token}"}, params=params, stream=stream)
+        if response.status_code == 401:
+            response.close()
+            logging.info("IronSource returned 401, refreshing Bearer token.")
+            with self._lock:
+                # Another thread may already have refreshed the token
+                if self._token == token:
+                    self._request_token()
+            response = self._send(url, {"Authorization": f"Bearer {self.get_bearer_token()}"}, params=params, stream=stream)
+        response.raise_for_status()
+        return response
+
+    # Query parameters of a v6 stats request; filters narrow it down, e.g. {"adUnits": "banner"}
+    @staticmethod
+    def _stats_params(app_key, start_date, end_date, breakdowns, metrics, filters=None):
+        return {
+            "startDate": start_date,
+            "endDate": end_date,
+            "breakdowns": breakdowns,
+            "metrics": metrics,
+            "appKey": app_key,
+            **(filters or {})
+        }
+
+    # Yield rows from the v6 stats endpoint as they are parsed from the response stream
+    def iter_stats(self, app_key, start_date, end_date, breakdowns, metrics, filters=None):
+        params = self._stats_params(app_key, start_date, end_date, breakdowns, metrics, filters)
+        response = self.get(STATS_URL, params=params, stream=True)
+        received = {'bytes': 0, 'rows': 0}
+        decoder = codecs.getincrementaldecoder('utf-8')()
+
+        def text_chunks():
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                received['bytes'] += len(chunk)
+                yield decoder.decode(chunk)
+            yield decoder.decode(b'', final=True)
+
+        with response:
+            for item in iter_json_array(text_chunks()):
+                received['rows'] += 1
+                yield item
+        count('ironsource.bytes', received['bytes'])
+        logging.info("Received %d rows (%d bytes) for %s from %s to %s", received['rows'], received['bytes'], app_key, start_date, end_date)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+# Return the process-wide IronSource client built from the environment
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = IronSourceClient(os.getenv('IRONSOURCE_SECRET_KEY'), os.getenv('IRONSOURCE_REFRESH_TOKEN'), cassette=cassette_from_env())
+        return _client
@@ -0,0 +1,27 @@
+import os
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from profiling import run_profiled
+
+# Upper bound on concurrent IronSource requests
+max_workers = int(os.getenv('IRONSOURCE_MAX_WORKERS', '4'))
+
+
+# Fetch every app key concurrently, at most `workers` at a time, and return the results keyed by app name
+def fetch_platforms(fetch, app_keys, start_date, end_date, workers=max_workers):
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(app_keys)))) as executor:
+        futures = {
+            # Run in a copy of the caller's context so the calls are counted towards the caller's script
+            platform: executor.submit(contextvars.copy_context().run, run_profiled, fetch, app_key, start_date, end_date)
+            for platform, app_key in app_keys.items()
+        }
+        # Collect in the order the apps were given; a failed app is logged and skipped
+        for platform, future in futures.items():
+            try:
+                results[platform] = future.result()
+            except Exception as e:
+                logging.error(f"Failed to fetch {platform} data: {e}")
+    return results
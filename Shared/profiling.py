@@ -0,0 +1,138 @@
+import os
+import re
+import sys
+import time
+import pstats
+import cProfile
+import logging
+import threading
+import tracemalloc
+from itertools import count as counter
+from contextlib import contextmanager
+
+# Profiling is off unless RUN_PROFILE=1 or the entry point was started with --profile
+profiling_enabled = os.getenv('RUN_PROFILE', '0') == '1' or '--profile' in sys.argv
+profile_dir = os.getenv('PROFILE_DIR', 'Summary/profiles')
+
+# Hot spots listed per stage in the summary
+TOP_FUNCTIONS = 8
+TOP_ALLOCATIONS = 5
+
+# Entry point name used for stages recorded outside an orchestrator step, e.g. "fillrate"
+ENTRY_SCRIPT = os.path.splitext(os.path.basename(sys.argv[0] or 'python'))[0]
+
+# Leave tracemalloc's own and the import machinery's allocations out of the report
+_SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>')
+]
+
+# One stage is profiled at a time: from Python 3.12 a process can only run one cProfile profiler.
+# A stage that starts while another is being profiled, e.g. in a concurrent orchestrator step, is not profiled.
+_profile_lock = threading.Lock()
+_summary_lock = threading.Lock()
+_stage_numbers = counter(1)
+
+# cProfile only sees the thread that enabled it, so pool threads working for the profiled stage
+# profile themselves through run_profiled; their profiles are merged into the stage's report
+_worker_profiles = None
+_workers_lock = threading.Lock()
+_profiled_thread = threading.local()
+
+
+# Readable name of a profiled function, e.g. "waterfall.py:69(build_batch)"
+def _function_label(function):
+    filename, line, name = function
+    if filename == '~':
+        return name  # Built-in
+    return f"{os.path.basename(filename)}:{line}({name})"
+
+
+# Hot-spot lines of one stage: the functions with the most own time and the lines that kept the most memory
+def _summary_lines(script, name, seconds, peak, profile_file, stats, allocations):
+    lines = [f"{script} / {name}: {seconds:.2f}s, {peak / 2 ** 20:.1f} MiB peak allocated ({profile_file})"]
+    functions = sorted(stats.stats.items(), key=lambda entry: entry[1][2], reverse=True)[:TOP_FUNCTIONS]
+    for function, (_, calls, own_time, cumulative_time, _) in functions:
+        lines.append(f"  {own_time:8.3f}s own {cumulative_time:8.3f}s cumulative {calls:>9} calls  {_function_label(function)}")
+    for stat in allocations[:TOP_ALLOCATIONS]:
+        frame = stat.traceback[0]
+        lines.append(f"  {stat.size / 1024:10.1f} KiB in {stat.count} blocks  {os.path.basename(frame.filename)}:{frame.lineno}")
+    return lines
+
+
+# Save the cProfile stats of a stage and append its hot spots to the run's summary
+def _write_report(script, name, seconds, peak, profile, workers, allocations):
+    try:
+        os.makedirs(profile_dir, exist_ok=True)
+        profile_file = f"{script}-{next(_stage_numbers):03d}-{re.sub(r'[^A-Za-z0-9.-]+', '_', name)[:60]}.prof"
+        stats = pstats.Stats(profile)
+        for worker in workers:
+            stats.add(worker)
+        stats.dump_stats(os.path.join(profile_dir, profile_file))
+        lines = _summary_lines(script, name, seconds, peak, profile_file, stats, allocations)
+        if workers:
+            lines[0] += f", {len(workers)} pool thread calls merged"
+        with _summary_lock:
+            with open(os.path.join(profile_dir, 'hotspots.txt'), 'a') as file:
+                file.write('\n'.join(lines) + '\n\n')
+        logging.info(f"Profiled {lines[0]}")
+    except OSError as e:
+        logging.warning(f"Could not save the profile of {script} / {name}: {e}")
+
+
+# Profile the block with cProfile and trace the memory it allocates and keeps.
+# Traces are cleared at the start, so one small snapshot at the end holds only the stage's allocations.
+# Saves <script>-<n>-<stage>.prof, readable with pstats or snakeviz, and adds the stage to hotspots.txt.
+# Work the stage hands to a thread pool is only included when it was submitted through run_profiled.
+@contextmanager
+def profile_stage(name, script=None):
+    global _worker_profiles
+    if not profiling_enabled or not _profile_lock.acquire(blocking=False):
+        yield
+        return
+    try:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.clear_traces()
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        _worker_profiles = []
+        _profiled_thread.active = True
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            _profiled_thread.active = False
+            with _workers_lock:
+                workers, _worker_profiles = _worker_profiles, None
+            seconds = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1]
+            allocations = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS).statistics('lineno')
+            _write_report(script or ENTRY_SCRIPT, name, seconds, peak, profile, workers, allocations)
+    finally:
+        _profile_lock.release()
+
+
+# Call fn(*args, **kwargs) in a pool thread, profiling it for the stage being profiled, if any.
+# From Python 3.12 the stage's profiler already sees every thread and a second one cannot start, so fn just runs.
+def run_profiled(fn, *args, **kwargs):
+    with _workers_lock:
+        profiles = _worker_profiles
+    if profiles is None or getattr(_profiled_thread, 'active', False):
+        return fn(*args, **kwargs)
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        return fn(*args, **kwargs)
+    _profiled_thread.active = True
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profile.disable()
+        _profiled_thread.active = False
+        with _workers_lock:
+            profiles.append(profile)
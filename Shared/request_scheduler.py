@@ -0,0 +1,145 @@
+import os
+import time
+import random
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+
+import requests
+import urllib3
+from run_metrics import count
+
+# Sustained requests per second and burst size for each API.
+# Sheets allows 60 requests per minute per user, so stay just under one per second.
+RATES = {
+    'ironsource': (float(os.getenv('IRONSOURCE_RATE_PER_SECOND', '5')), 10),
+    'sheets': (float(os.getenv('SHEETS_RATE_PER_SECOND', '0.9')), 5),
+    'drive': (float(os.getenv('DRIVE_RATE_PER_SECOND', '5')), 10),
+    'slack': (float(os.getenv('SLACK_RATE_PER_SECOND', '1')), 3),
+}
+
+# Retry settings
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# A call that is not idempotent may already have taken effect when the server answers 5xx, so it only
+# retries rate limiting and connections that failed before anything was sent
+NOT_SENT_STATUS = {429}
+MAX_RETRIES = int(os.getenv('REQUEST_MAX_RETRIES', '5'))
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+
+# Every call must finish before the run deadline, counted from process start
+run_deadline = time.monotonic() + float(os.getenv('RUN_DEADLINE_SECONDS', '1800'))
+
+
+# Raised when waiting for a rate limit or a retry would overrun the run deadline
+class DeadlineExceeded(Exception):
+    pass
+
+
+# Token bucket limiting the request rate to one API
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Take one token, sleeping until one is available
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            _sleep(wait)
+
+
+_buckets = {api: TokenBucket(rate, capacity) for api, (rate, capacity) in RATES.items()}
+
+
+# Sleep, unless that would run past the deadline
+def _sleep(seconds):
+    if time.monotonic() + seconds > run_deadline:
+        raise DeadlineExceeded(f"Waiting {seconds:.1f}s would pass the run deadline")
+    time.sleep(seconds)
+
+
+# Parse a Retry-After header given in seconds or as an HTTP date
+def _parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# Whether a requests connection error happened before the request was sent, e.g. a refused or timed-out connect
+def _not_sent(error):
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
+# Return (retryable, retry_after) for an exception raised by requests, gspread or googleapiclient
+def _retry_info(error, idempotent=True):
+    statuses = RETRYABLE_STATUS if idempotent else NOT_SENT_STATUS
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return idempotent or _not_sent(error), None
+
+    # requests.HTTPError and gspread's APIError carry a requests.Response
+    response = getattr(error, 'response', None)
+    if response is not None and hasattr(response, 'status_code'):
+        return response.status_code in statuses, _parse_retry_after(response.headers.get('Retry-After'))
+
+    # googleapiclient's HttpError carries an httplib2 response
+    resp = getattr(error, 'resp', None)
+    if resp is not None and hasattr(resp, 'status'):
+        return int(resp.status) in statuses, _parse_retry_after(resp.get('retry-after'))
+
+    return False, None
+
+
+# Call fn through the rate limiter of the given API, retrying 429 and 5xx errors with backoff.
+# Pass idempotent=False for calls that must not run twice, such as appends, copies and posts.
+def scheduled(api, fn, *args, idempotent=True, **kwargs):
+    bucket = _buckets[api]
+    attempt = 0
+    while True:
+        bucket.acquire()
+        count(f'{api}.requests')
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            retryable, retry_after = _retry_info(e, idempotent)
+            if not retryable or attempt >= MAX_RETRIES:
+                raise
+            # Full jitter exponential backoff, but never sooner than the server asked for
+            delay = random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** attempt))
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            attempt += 1
+            count(f'{api}.retries')
+            logging.warning(f"{api} call failed ({e}), retry {attempt}/{MAX_RETRIES} in {delay:.1f}s")
+            _sleep(delay)
+
+
+# Send an HTTP request through the scheduler; retryable status codes raise so that they are retried
+def scheduled_request(api, method, *args, idempotent=True, **kwargs):
+    def attempt():
+        response = method(*args, **kwargs)
+        if response.status_code in (RETRYABLE_STATUS if idempotent else NOT_SENT_STATUS):
+            response.close()
+            response.raise_for_status()
+        return response
+    return scheduled(api, attempt, idempotent=idempotent)
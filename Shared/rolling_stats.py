@@ -0,0 +1,174 @@
+import os
+import math
+import sqlite3
+import logging
+import threading
+
+from run_summary import add_notes
+
+# Store settings; unlike the warehouse this is history, so keep it when clearing caches
+rolling_stats_path = os.getenv('ROLLING_STATS_PATH', '.cache/rolling_stats.sqlite3')
+ewma_alpha = float(os.getenv('ROLLING_EWMA_ALPHA', '0.2'))  # Weight of the newest day in the EWMA
+
+# Anomaly thresholds: a value is flagged when it is this many EW standard deviations below the EWMA,
+# at least this fraction below it, and the series has enough history and revenue to matter
+anomaly_z = float(os.getenv('ANOMALY_Z_THRESHOLD', '3'))
+anomaly_min_drop = float(os.getenv('ANOMALY_MIN_DROP', '0.3'))
+anomaly_min_history = int(os.getenv('ANOMALY_MIN_HISTORY', '7'))
+anomaly_min_revenue = float(os.getenv('ANOMALY_MIN_REVENUE', '1'))
+
+# Most anomalies listed in the Slack summary
+MAX_REPORTED = 10
+
+# Keys looked up per query, below SQLite's parameter limit
+LOOKUP_CHUNK = 500
+
+INSTANCE_METRICS = {'eCPM': 'eCPM', 'revenue': 'revenue', 'adSourceAvailabilityRate': 'availability rate'}
+APP_METRICS = {'eCPM': 'eCPM', 'revenue': 'revenue', 'appFillRate': 'fill rate'}
+
+
+# Per-series running mean and variance (Welford) and exponentially weighted mean and variance, one row per metric.
+# Each day's update reads and writes only the series in that day's rows.
+class RollingStats:
+    def __init__(self, path=rolling_stats_path, alpha=ewma_alpha):
+        self.path = path
+        self.alpha = alpha
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rolling ("
+                " scope TEXT, series TEXT, metric TEXT, count INTEGER, mean REAL, m2 REAL, ewma REAL, ewvar REAL, last_date TEXT,"
+                " PRIMARY KEY (scope, series, metric))"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    # Return {(series, metric): state} for the given series
+    def _load(self, conn, scope, series):
+        states = {}
+        series = sorted(series)
+        for start in range(0, len(series), LOOKUP_CHUNK):
+            chunk = series[start:start + LOOKUP_CHUNK]
+            placeholders = ','.join('?' for _ in chunk)
+            cursor = conn.execute(
+                f"SELECT series, metric, count, mean, m2, ewma, ewvar, last_date FROM rolling WHERE scope = ? AND series IN ({placeholders})",
+                [scope] + chunk
+            )
+            for name, metric, count, mean, m2, ewma, ewvar, last_date in cursor:
+                states[(name, metric)] = {'count': count, 'mean': mean, 'm2': m2, 'ewma': ewma, 'ewvar': ewvar, 'last_date': last_date}
+        return states
+
+    # Check a new value against the state before it is added
+    def _assess(self, state, value, revenue_ewma):
+        if state['count'] < anomaly_min_history or revenue_ewma < anomaly_min_revenue:
+            return None
+        expected = state['ewma']
+        std = math.sqrt(state['ewvar'])
+        if std <= 0 or expected <= 0:
+            return None
+        z = (value - expected) / std
+        if z <= -anomaly_z and value <= expected * (1 - anomaly_min_drop):
+            return round(z, 2)
+        return None
+
+    # Add one day per series; observations are (series, date, {metric: value}).
+    # Days at or before a series' last recorded day are skipped, so re-runs never count a day twice.
+    # Returns the anomalies found, as dicts.
+    def update(self, scope, observations):
+        observations = sorted(observations, key=lambda observation: observation[1])
+        anomalies = []
+        with self._connect() as conn:
+            states = self._load(conn, scope, {series for series, _, _ in observations})
+            changed = set()
+            for series, date_str, values in observations:
+                revenue_state = states.get((series, 'revenue'))
+                revenue_ewma = revenue_state['ewma'] if revenue_state else 0.0
+                for metric, value in values.items():
+                    value = float(value or 0)
+                    state = states.get((series, metric))
+                    if state is None:
+                        state = states[(series, metric)] = {'count': 0, 'mean': 0.0, 'm2': 0.0, 'ewma': value, 'ewvar': 0.0, 'last_date': ''}
+                    if date_str <= state['last_date']:
+                        continue
+
+                    z = self._assess(state, value, revenue_ewma)
+                    if z is not None:
+                        anomalies.append({'scope': scope, 'series': series, 'metric': metric, 'date': date_str,
+                                          'value': value, 'expected': state['ewma'], 'z': z})
+
+                    # Welford's update of the running mean and variance
+                    state['count'] += 1
+                    delta = value - state['mean']
+                    state['mean'] += delta / state['count']
+                    state['m2'] += delta * (value - state['mean'])
+
+                    # Exponentially weighted mean and variance
+                    ew_delta = value - state['ewma']
+                    state['ewma'] += self.alpha * ew_delta
+                    state['ewvar'] = (1 - self.alpha) * (state['ewvar'] + self.alpha * ew_delta ** 2)
+                    state['last_date'] = date_str
+                    changed.add((series, metric))
+
+            conn.executemany(
+                "INSERT OR REPLACE INTO rolling (scope, series, metric, count, mean, m2, ewma, ewvar, last_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(scope, series, metric, state['count'], state['mean'], state['m2'], state['ewma'], state['ewvar'], state['last_date'])
+                 for (series, metric), state in ((key, states[key]) for key in changed)]
+            )
+        return anomalies
+
+
+_rolling_stats = None
+_rolling_stats_lock = threading.Lock()
+
+
+# Return the process-wide rolling statistics store
+def get_rolling_stats():
+    global _rolling_stats
+    with _rolling_stats_lock:
+        if _rolling_stats is None:
+            _rolling_stats = RollingStats()
+        return _rolling_stats
+
+
+# Observations of every instance in fill-rate view rows
+def instance_observations(items):
+    for item in items:
+        series = ' | '.join(str(item.get(field, '')) for field in ('appName', 'adUnits', 'providerName', 'instanceName'))
+        for data in item.get('data', []):
+            yield series, str(item.get('date', ''))[:10], {metric: data.get(metric, 0) for metric in INSTANCE_METRICS}
+
+
+# Observations of every app in 'date,app' rows of one platform
+def app_observations(items, platform_name):
+    for item in items:
+        series = f"{item.get('appName', '')} ({platform_name})"
+        for data in item.get('data', []):
+            yield series, str(item.get('date', '')).strip("'")[:10], {metric: data.get(metric, 0) for metric in APP_METRICS}
+
+
+# Summary lines for the worst anomalies, e.g. "eCPM of App | RV | Network 1 | Instance 2 fell to 3.10 (usually 9.80, z -4.1) on 2024-01-02"
+def anomaly_lines(anomalies):
+    names = {**INSTANCE_METRICS, **APP_METRICS}
+    anomalies = sorted(anomalies, key=lambda anomaly: anomaly['z'])
+    lines = [
+        f"Anomaly: {names.get(anomaly['metric'], anomaly['metric'])} of {anomaly['series']} fell to {anomaly['value']:.2f} "
+        f"(usually {anomaly['expected']:.2f}, z {anomaly['z']:.1f}) on {anomaly['date']}"
+        for anomaly in anomalies[:MAX_REPORTED]
+    ]
+    if len(anomalies) > MAX_REPORTED:
+        lines.append(f"Anomaly: {len(anomalies) - MAX_REPORTED} more not shown")
+    return lines
+
+
+# Update the store and add any anomalies to the step's entry in the run summary; never fails the calling script
+def record_and_report(scope, observations, step):
+    try:
+        anomalies = get_rolling_stats().update(scope, observations)
+    except sqlite3.Error as e:
+        logging.error(f"Failed to update rolling {scope} statistics: {e}")
+        return []
+    logging.info(f"Rolling {scope} statistics updated, {len(anomalies)} anomalies")
+    add_notes(step, anomaly_lines(anomalies))
+    return anomalies
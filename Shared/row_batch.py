@@ -0,0 +1,70 @@
+from sys import intern
+from array import array
+
+
+# One column of a RowBatch: interned strings in a list, numbers in a typed array
+class Column:
+    __slots__ = ('header', 'source', 'key', 'kind', 'values')
+
+    def __init__(self, header, source, key, kind='str'):
+        self.header = header
+        self.source = source  # 'item' for breakdown fields, 'data' for metrics
+        self.key = key
+        self.kind = kind
+        if kind == 'float':
+            self.values = array('d')
+        elif kind == 'int':
+            self.values = array('q')
+        else:
+            self.values = []
+
+
+# Columnar batch of IronSource stats rows, one row per 'data' entry of a stats item
+class RowBatch:
+    __slots__ = ('columns', 'length')
+
+    # spec is a list of (header, source, key, kind) tuples, in sheet column order
+    def __init__(self, spec):
+        self.columns = [Column(*column) for column in spec]
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    # Append every row of a stats response
+    def extend(self, items):
+        item_columns = [(column.key, column.values.append) for column in self.columns if column.source == 'item']
+        data_columns = [(column.key, column.values.append, float if column.kind == 'float' else int)
+                        for column in self.columns if column.source == 'data']
+        for item in items:
+            # Breakdown strings repeat on every row, so intern them once per item; a null or number becomes a string too
+            strings = []
+            for key, append in item_columns:
+                value = item.get(key)
+                strings.append((append, intern(value if type(value) is str else '' if value is None else str(value))))
+            for data in item.get('data', []):  # Ensure 'data' field exists
+                for append, value in strings:
+                    append(value)
+                for key, append, convert in data_columns:
+                    append(convert(data.get(key, 0) or 0))
+                self.length += 1
+
+    # Values of the column with the given header
+    def column(self, header):
+        for column in self.columns:
+            if column.header == header:
+                return column.values
+        raise KeyError(header)
+
+    # Header row, in sheet column order
+    def header(self):
+        return [column.header for column in self.columns]
+
+    # Kind of every column by header, e.g. {"Revenue": "float"}
+    def kinds(self):
+        return {column.header: column.kind for column in self.columns}
+
+    # Yield the rows as lists in one pass over the columns
+    def iter_rows(self):
+        for row in zip(*(column.values for column in self.columns)):
+            yield list(row)
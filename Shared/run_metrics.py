@@ -0,0 +1,124 @@
+import os
+import json
+import time
+import threading
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+from profiling import profile_stage
+
+# One metrics file per workflow run; every script of the run adds its own section
+metrics_file_path = os.getenv('RUN_METRICS_FILE', 'Summary/metrics.json')
+run_id = os.getenv('GITHUB_RUN_ID') or datetime.now().strftime('%Y-%m-%d')
+
+_lock = threading.Lock()
+_file_lock = threading.Lock()
+
+# Script whose stages and counters are being recorded; None when each script runs in its own process.
+# Worker threads only see it when started through contextvars.copy_context().run.
+_current_script = contextvars.ContextVar('run_metrics_script', default=None)
+
+
+# Stages and counters recorded for one script since its last flush
+def _new_section():
+    return {'stages': [], 'counters': defaultdict(int), 'started': time.perf_counter()}
+
+
+_sections = {None: _new_section()}
+
+
+# Section of the script running in the current context
+def _section():
+    script = _current_script.get()
+    section = _sections.get(script)
+    if section is None:
+        section = _sections[script] = _new_section()
+    return section
+
+
+# Record everything inside the block under script, so several scripts can run concurrently in one process
+@contextmanager
+def script_section(script):
+    token = _current_script.set(script)
+    with _lock:
+        _sections[script] = _new_section()
+    try:
+        yield
+    finally:
+        _current_script.reset(token)
+
+
+# Time a stage of the script; fields such as rows can be set on the yielded record.
+# In profiling mode (RUN_PROFILE=1 or --profile) the stage is also profiled, see profiling.py.
+@contextmanager
+def stage(name, **fields):
+    record = {'name': name, **fields}
+    started = time.perf_counter()
+    try:
+        with profile_stage(name, _current_script.get()):
+            yield record
+        record.setdefault('status', 'ok')
+    except Exception:
+        record['status'] = 'error'
+        raise
+    finally:
+        record['seconds'] = round(time.perf_counter() - started, 3)
+        with _lock:
+            _section()['stages'].append(record)
+
+
+# Add to a named counter such as 'sheets.requests' or 'ironsource.bytes'
+def count(name, amount=1):
+    with _lock:
+        _section()['counters'][name] += amount
+
+
+# Load the metrics of the current run, starting over when the file belongs to an older run
+def load_run_metrics():
+    try:
+        with open(metrics_file_path, 'r') as file:
+            metrics = json.load(file)
+    except (OSError, ValueError):
+        return {'run_id': run_id, 'scripts': {}}
+    if metrics.get('run_id') != run_id:
+        return {'run_id': run_id, 'scripts': {}}
+    return metrics
+
+
+# Write the stages and counters recorded since the last flush into the run's metrics file under script
+def flush(script):
+    with _lock:
+        section = _section()
+        # Start a fresh section, for when several scripts run in one process
+        _sections[_current_script.get()] = _new_section()
+    # Concurrent scripts each rewrite the whole file, so one at a time
+    with _file_lock:
+        metrics = load_run_metrics()
+        metrics['scripts'][script] = {
+            'finished_at': datetime.now().isoformat(timespec='seconds'),
+            'total_seconds': round(time.perf_counter() - section['started'], 3),
+            'stages': section['stages'],
+            'counters': dict(section['counters'])
+        }
+        os.makedirs(os.path.dirname(metrics_file_path) or '.', exist_ok=True)
+        with open(metrics_file_path, 'w') as file:
+            json.dump(metrics, file, indent=2)
+
+
+# Compact one-line timing summary of the run for Slack, e.g. "fillrate 4.2s (fetch 3.1s, write 0.8s, 2 retries)"
+def timing_line():
+    scripts = load_run_metrics()['scripts']
+    parts = []
+    for script, metrics in scripts.items():
+        # Add up the stages by their first word, so each sheet write counts towards "sheets"
+        totals = defaultdict(float)
+        for record in metrics['stages']:
+            totals[record['name'].split('.')[0].split(':')[0]] += record['seconds']
+        details = [f"{name} {seconds:.1f}s" for name, seconds in totals.items()]
+        retries = sum(value for name, value in metrics['counters'].items() if name.endswith('.retries'))
+        if retries:
+            details.append(f"{retries} retries")
+        parts.append(f"{script} {metrics['total_seconds']:.1f}s" + (f" ({', '.join(details)})" if details else ''))
+    return f"Timing: {' | '.join(parts)}" if parts else ''
@@ -0,0 +1,88 @@
+import os
+import json
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from run_metrics import run_id
+
+# Results of one workflow run for the Slack summary; every step adds its own entry.
+# Timings are not repeated here, they are in the run's metrics file.
+summary_file_path = os.getenv('RUN_SUMMARY_FILE', 'Summary/run_summary.json')
+
+# Concurrent steps each rewrite the whole file, so one at a time
+_file_lock = threading.Lock()
+
+
+# Load the summary of the current run, starting over when the file belongs to an older run
+def load_run_summary():
+    try:
+        with open(summary_file_path, 'r') as file:
+            summary = json.load(file)
+    except (OSError, ValueError):
+        return {'run_id': run_id, 'steps': {}}
+    if summary.get('run_id') != run_id:
+        return {'run_id': run_id, 'steps': {}}
+    return summary
+
+
+# Apply change(summary) to the run's summary file and save it atomically
+def _update(change):
+    with _file_lock:
+        summary = load_run_summary()
+        change(summary)
+        os.makedirs(os.path.dirname(summary_file_path) or '.', exist_ok=True)
+        temp_path = f'{summary_file_path}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(summary, file, indent=2)
+        os.replace(temp_path, summary_file_path)
+
+
+def _entry(summary, step):
+    return summary['steps'].setdefault(step, {'status': 'running', 'rows': 0, 'links': [], 'notes': []})
+
+
+# Rows a step wrote
+def add_rows(step, rows):
+    def change(summary):
+        _entry(summary, step)['rows'] += rows
+    _update(change)
+
+
+# Link shown with a step, e.g. the sheet it wrote
+def add_link(step, label, url):
+    _update(lambda summary: _entry(summary, step)['links'].append({'label': label, 'url': url}))
+
+
+# Lines shown under a step, e.g. anomalies
+def add_notes(step, lines):
+    if lines:
+        _update(lambda summary: _entry(summary, step)['notes'].extend(lines))
+
+
+# Set a step's final status, with the error that failed it
+def set_status(step, status, error=None):
+    def change(summary):
+        entry = _entry(summary, step)
+        entry['status'] = status
+        entry['finished_at'] = datetime.now().isoformat(timespec='seconds')
+        if error:
+            entry['error'] = error
+    _update(change)
+
+
+# Run a step, starting its entry afresh and recording whether it succeeded; exceptions are re-raised
+@contextmanager
+def step_status(step):
+    _update(lambda summary: summary['steps'].pop(step, None))
+    try:
+        yield
+    except Exception as e:
+        set_status(step, 'error', f"{type(e).__name__}: {e}")
+        raise
+    set_status(step, 'ok')
+
+
+# Remember the Slack message of the run, so a re-run of the summary updates it
+def set_slack_message(key, ts):
+    _update(lambda summary: summary.update(slack={'key': key, 'ts': ts}))
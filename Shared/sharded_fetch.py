@@ -0,0 +1,125 @@
+import os
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from run_metrics import count
+from profiling import run_profiled
+
+# Sharded mode splits a stats query into one query per ad unit, run in parallel
+sharding_enabled = os.getenv('IRONSOURCE_SHARDED', '0') == '1'
+shard_workers = int(os.getenv('IRONSOURCE_SHARD_WORKERS', '4'))
+shard_retries = int(os.getenv('IRONSOURCE_SHARD_RETRIES', '1'))  # Extra attempts of a shard that failed or did not add up
+# Allowed difference between a shard's impressions and its discovery query, for revisions between the two queries
+shard_tolerance = float(os.getenv('IRONSOURCE_SHARD_TOLERANCE', '0.001'))
+
+# Ad units, as the API names them in rows, that are always split further by ad source, e.g. "Rewarded Video".
+# Any other ad unit is split by ad source only when its shard keeps failing.
+split_by_source = [name.strip() for name in os.getenv('IRONSOURCE_SPLIT_BY_SOURCE', '').split(',') if name.strip()]
+
+# adUnits filter values for the names the API returns in rows; other names are camel-cased, e.g. "Native Ad" -> "nativeAd"
+AD_UNIT_FILTERS = {
+    'Rewarded Video': 'rewardedVideo',
+    'Interstitial': 'interstitial',
+    'Banner': 'banner',
+    'Offerwall': 'offerWall'
+}
+
+
+# adUnits filter value of an ad unit
+def ad_unit_filter(ad_unit):
+    if ad_unit in AD_UNIT_FILTERS:
+        return AD_UNIT_FILTERS[ad_unit]
+    words = ad_unit.split()
+    return ''.join([words[0].lower()] + [word.capitalize() for word in words[1:]]) if words else ad_unit
+
+
+# Raised when a shard does not add up to the impressions its discovery query reported,
+# e.g. because the API did not recognise a filter value and returned nothing
+class ShardMismatch(ValueError):
+    pass
+
+
+# Impressions of each value of one breakdown over the range, from a small single-metric query
+def _totals(fetch_range, app_key, start_date, end_date, breakdown, field, filters=None):
+    totals = {}
+    for item in fetch_range(app_key, start_date, end_date, breakdown, 'impressions', filters=filters):
+        if item.get(field):
+            totals[item[field]] = totals.get(item[field], 0) + _impressions([item])
+    return dict(sorted(totals.items()))
+
+
+def _impressions(items):
+    return sum(data.get('impressions', 0) or 0 for item in items for data in item.get('data', []))
+
+
+# Check that a shard is not empty and adds up to the impressions expected of it
+def _check(rows, expected, app_key, label):
+    impressions = _impressions(rows)
+    if not rows or abs(impressions - expected) > max(1, expected * shard_tolerance):
+        raise ShardMismatch(f"Shard {label} of {app_key} has {len(rows)} rows and {impressions} impressions, expected {expected}")
+
+
+# Run one shard query and check it, retrying it on its own when the response fails part-way or does not add up.
+# Rows of other shards, from a filter the API ignored, are dropped, and the check catches anything wrongly dropped.
+def _query(fetch_range, app_key, start_date, end_date, breakdowns, metrics, filters, match, expected):
+    for attempt in range(shard_retries + 1):
+        try:
+            items = list(fetch_range(app_key, start_date, end_date, breakdowns, metrics, filters=filters))
+            rows = [item for item in items if all(item.get(field) == value for field, value in match.items())]
+            if len(rows) < len(items):
+                logging.warning(f"Shard {match} of {app_key} returned {len(items) - len(rows)} rows of other shards")
+            _check(rows, expected, app_key, match)
+            return rows
+        except (requests.RequestException, ValueError) as e:
+            if attempt == shard_retries:
+                raise
+            count('ironsource.shard_retries')
+            logging.warning(f"Shard {match} of {app_key} failed ({e}), retrying it")
+
+
+# Fetch one ad unit, split by ad source when configured or when the whole ad unit keeps failing
+def _fetch_ad_unit(fetch_range, app_key, start_date, end_date, breakdowns, metrics, ad_unit, expected):
+    filters = {'adUnits': ad_unit_filter(ad_unit)}
+    if ad_unit not in split_by_source:
+        try:
+            return _query(fetch_range, app_key, start_date, end_date, breakdowns, metrics, filters, {'adUnits': ad_unit}, expected)
+        except (requests.RequestException, ValueError) as e:
+            logging.warning(f"Shard {ad_unit} of {app_key} failed ({e}), splitting it by ad source")
+
+    sources = _totals(fetch_range, app_key, start_date, end_date, 'adSource', 'providerName', filters)
+    count('ironsource.shards', len(sources))
+    rows = []
+    for source, source_expected in sources.items():
+        rows.extend(_query(fetch_range, app_key, start_date, end_date, breakdowns, metrics,
+                           dict(filters, adSource=source), {'adUnits': ad_unit, 'providerName': source}, source_expected))
+    # The sources must add up to the ad unit, or the ad unit filter itself was not recognised
+    _check(rows, expected, app_key, {'adUnits': ad_unit})
+    return rows
+
+
+# Wrap fetch_range(app_key, start_date, end_date, breakdowns, metrics, filters=None) so queries broken down by
+# adUnits run as one shard per ad unit, at most `workers` at a time. A failed shard is retried on its own;
+# if any shard still fails or does not add up, the whole fetch raises, so the warehouse never stores a partial day.
+# Rows come back in date order; fetch_superset puts each day in its canonical order in both modes.
+def sharded(fetch_range, workers=shard_workers):
+    def fetch(app_key, start_date, end_date, breakdowns, metrics):
+        if 'adUnits' not in breakdowns.split(','):
+            return fetch_range(app_key, start_date, end_date, breakdowns, metrics)
+
+        ad_units = _totals(fetch_range, app_key, start_date, end_date, 'adUnits', 'adUnits')
+        if not ad_units:
+            return []
+        count('ironsource.shards', len(ad_units))
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(ad_units)))) as executor:
+            # Run in a copy of the caller's context so the calls are counted towards the caller's script
+            futures = [executor.submit(contextvars.copy_context().run, run_profiled, _fetch_ad_unit,
+                                       fetch_range, app_key, start_date, end_date, breakdowns, metrics, ad_unit, expected)
+                       for ad_unit, expected in ad_units.items()]
+            rows = [item for future in futures for item in future.result()]
+        rows.sort(key=lambda item: str(item.get('date', '')).strip("'")[:10])
+        logging.info(f"Merged {len(rows)} rows of {app_key} from {len(ad_units)} ad unit shards")
+        return rows
+    return fetch
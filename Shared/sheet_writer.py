@@ -0,0 +1,125 @@
+import json
+import logging
+from gspread.utils import absolute_range_name
+from request_scheduler import scheduled
+from run_metrics import stage
+
+# Sheets rejects request bodies much above 2 MB, so keep each chunk comfortably below that
+MAX_CHUNK_BYTES = 1_500_000
+
+
+# Compare a value read back from Sheets with the value we are about to write
+def _same_value(old, new):
+    if old == new:
+        return True
+    try:
+        return float(old) == float(new)  # UNFORMATTED_VALUE may return 5 where we send 5.0
+    except (TypeError, ValueError):
+        return str(old) == str(new)
+
+
+# Compare two rows, treating the cells Sheets trims from the end of a row as empty
+def _same_row(old, new):
+    old = list(old) + [''] * (len(new) - len(old))
+    return len(old) == len(new) and all(_same_value(o, n) for o, n in zip(old, new))
+
+
+# Make sure the tab has enough rows for a write ending at last_row and return its row count.
+# gspread 3.7 keeps sheet.row_count at its value when the tab was opened, even after a resize,
+# so a caller that grows the tab more than once passes the count returned by the previous call.
+def ensure_rows(sheet, last_row, row_count=None):
+    row_count = sheet.row_count if row_count is None else row_count
+    if row_count < last_row:
+        scheduled('sheets', sheet.resize, rows=last_row)
+        return last_row
+    return row_count
+
+
+# Write values to the first_col:last_col block, sending only the rows that changed since the last run
+def write_incremental(sheet, values, first_col='B', last_col='J', first_row=1):
+    width = len(values[0]) if values else 0
+
+    # Read the current block once
+    with stage(f'sheets.read:{sheet.title}') as record:
+        current = scheduled('sheets', sheet.get, f'{first_col}{first_row}:{last_col}', value_render_option='UNFORMATTED_VALUE')
+        record['rows'] = len(current)
+
+    # Group consecutive changed rows into one range each
+    updates = []
+    run_start = None
+    run = []
+    for i, row in enumerate(values):
+        old = current[i] if i < len(current) else []
+        if _same_row(old, row):
+            if run:
+                updates.append({'range': f'{first_col}{first_row + run_start}:{last_col}{first_row + run_start + len(run) - 1}', 'values': run})
+                run = []
+            continue
+        if not run:
+            run_start = i
+        run.append(row)
+    if run:
+        updates.append({'range': f'{first_col}{first_row + run_start}:{last_col}{first_row + run_start + len(run) - 1}', 'values': run})
+    changed_rows = sum(len(update['values']) for update in updates)
+
+    # Blank out whatever the previous, longer dataset left below the new one
+    if len(current) > len(values):
+        width = width or max(len(row) for row in current)
+        updates.append({
+            'range': f'{first_col}{first_row + len(values)}:{last_col}{first_row + len(current) - 1}',
+            'values': [[''] * width for _ in range(len(current) - len(values))]
+        })
+
+    if updates:
+        with stage(f'sheets.write:{sheet.title}', rows=changed_rows):
+            ensure_rows(sheet, first_row + len(values) - 1)
+            scheduled('sheets', sheet.batch_update, updates)
+
+    logging.info(f"Updated {changed_rows} of {len(values)} rows in '{sheet.title}' ({len(updates)} ranges)")
+    return changed_rows
+
+
+# Split rows into chunks whose JSON payload stays under max_bytes
+def chunk_rows(rows, max_bytes=MAX_CHUNK_BYTES):
+    chunk = []
+    size = 0
+    for row in rows:
+        row_size = len(json.dumps(row)) + 1
+        if chunk and size + row_size > max_bytes:
+            yield chunk
+            chunk = []
+            size = 0
+        chunk.append(row)
+        size += row_size
+    if chunk:
+        yield chunk
+
+
+# Replace the first_col:last_col block with values, sizing the write and the clear to the real data extent.
+# values may be a generator; rows are consumed one chunk at a time. Pass total_rows for a generator
+# of known length, so the tab is grown once up front rather than once per chunk past its end.
+def write_replace(sheet, values, first_col='B', last_col='J', first_row=1, max_bytes=MAX_CHUNK_BYTES, total_rows=None):
+    if total_rows is None and isinstance(values, list):
+        total_rows = len(values)
+
+    # Write the new data in chunks under the request-size limit
+    next_row = first_row
+    chunks = 0
+    with stage(f'sheets.write:{sheet.title}') as record:
+        row_count = sheet.row_count
+        if total_rows:
+            row_count = ensure_rows(sheet, first_row + total_rows - 1, row_count)
+        for chunk in chunk_rows(values, max_bytes):
+            last_row = next_row + len(chunk) - 1
+            row_count = ensure_rows(sheet, last_row, row_count)
+            scheduled('sheets', sheet.update, f'{first_col}{next_row}:{last_col}{last_row}', chunk)
+            next_row = last_row + 1
+            chunks += 1
+        record['rows'] = next_row - first_row
+
+    # Clear everything below the new data server-side, however far the previous data went
+    if next_row <= row_count:
+        with stage(f'sheets.clear:{sheet.title}'):
+            scheduled('sheets', sheet.spreadsheet.values_clear, absolute_range_name(sheet.title, f'{first_col}{next_row}:{last_col}'))
+
+    logging.info(f"Wrote {next_row - first_row} rows to '{sheet.title}' in {chunks} request(s)")
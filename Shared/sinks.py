@@ -0,0 +1,231 @@
+import os
+import re
+import csv
+import time
+import sqlite3
+import logging
+from itertools import count as counter, islice
+
+from run_metrics import stage
+
+# Parquet output needs pyarrow, which only the runs that select it have to install
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Where each run's output goes: a comma-separated list of sheets, csv, parquet and sqlite
+output_sinks = os.getenv('OUTPUT_SINKS', 'sheets')
+sink_dir = os.getenv('SINK_DIR', 'output')
+
+# Outputs sent to Sheets when it is one of several sinks, e.g. "recommendations" to keep the raw
+# tables on disk and give Sheets only the summarized view; empty sends everything
+sheets_outputs = os.getenv('SHEETS_OUTPUTS', '')
+
+# Rows per Parquet row group and per SQLite executemany
+WRITE_CHUNK_ROWS = 50_000
+
+# Numbers the Parquet part files written by this process
+_part_numbers = counter(1)
+
+
+# File and table name for a tab, e.g. "Placement Fill Rate" -> "placement_fill_rate"
+def table_name(tab_name):
+    return re.sub(r'[^0-9a-z]+', '_', tab_name.lower()).strip('_') or 'data'
+
+
+# Yield lists of up to size items
+def _chunks(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# Key of a row as strings, so rows read back from a file match the ones being written
+def _row_key(row, positions):
+    return tuple('' if row[position] is None else str(row[position]) for position in positions)
+
+
+# Arrow schema of a table: 'float' and 'int' columns of kinds as float64 and int64, every other column as string.
+# A fixed schema keeps every chunk and every run's part alike, e.g. when a metric is 95 in one run and 95.5 in the next.
+def _arrow_schema(header, kinds):
+    types = {'float': pyarrow.float64(), 'int': pyarrow.int64()}
+    return pyarrow.schema([(column, types.get(kinds.get(column), pyarrow.string())) for column in header])
+
+
+# Writes each table to <dir>/<table>.csv; append mode adds to the file, replacing rows with the same key
+class CsvSink:
+    name = 'csv'
+
+    def __init__(self, directory=sink_dir):
+        self.directory = directory
+
+    # Rewrite the file with the rows of the same key replaced in place and the new keys added at the end
+    def _merge(self, path, header, rows, key):
+        positions = [header.index(column) for column in key]
+        with open(path, 'r', newline='') as file:
+            reader = csv.reader(file)
+            next(reader, None)
+            merged = {_row_key(row, positions): row for row in reader}
+        count = 0
+        for row in rows:
+            merged[_row_key(row, positions)] = row
+            count += 1
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(header)
+            writer.writerows(merged.values())
+        os.replace(temp_path, path)
+        return count
+
+    def write(self, table, header, rows, mode='replace', key=None, kinds=None):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'{table}.csv')
+        if mode != 'replace' and key and os.path.exists(path):
+            return self._merge(path, header, rows, key)
+        new_file = mode == 'replace' or not os.path.exists(path)
+        count = 0
+        with open(path, 'w' if mode == 'replace' else 'a', newline='') as file:
+            writer = csv.writer(file)
+            if new_file:
+                writer.writerow(header)
+            for chunk in _chunks(rows, WRITE_CHUNK_ROWS):
+                writer.writerows(chunk)
+                count += len(chunk)
+        return count
+
+
+# Writes each table to <dir>/<table>.parquet; append mode adds a new part file to the <dir>/<table>/ dataset.
+# With a key, append mode rewrites the dataset as one part without the earlier rows of the keys being written.
+class ParquetSink:
+    name = 'parquet'
+
+    def __init__(self, directory=sink_dir):
+        if pyarrow is None:
+            raise RuntimeError("The parquet sink needs pyarrow: pip install pyarrow")
+        self.directory = directory
+
+    def write(self, table, header, rows, mode='replace', key=None, kinds=None):
+        earlier_parts = []
+        if mode == 'replace':
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f'{table}.parquet')
+        else:
+            dataset_dir = os.path.join(self.directory, table)
+            os.makedirs(dataset_dir, exist_ok=True)
+            if key:
+                earlier_parts = sorted(os.path.join(dataset_dir, name) for name in os.listdir(dataset_dir) if name.endswith('.parquet'))
+            part = f"part-{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}-{next(_part_numbers)}.parquet"
+            path = os.path.join(dataset_dir, part)
+
+        # The keys are only known once the rows are read, so a keyed append holds them in memory
+        if earlier_parts:
+            rows = list(rows)
+            positions = [header.index(column) for column in key]
+            keys = {_row_key(row, positions) for row in rows}
+
+        # Without kinds the schema is inferred from the first chunk
+        schema = _arrow_schema(header, kinds) if kinds else None
+        writer = None
+        count = 0
+        written = False
+        temp_path = f'{path}.tmp'
+        try:
+            if earlier_parts:
+                earlier = pyarrow.parquet.ParquetDataset(earlier_parts).read()
+                if schema is not None:
+                    earlier = earlier.select(header).cast(schema)
+                columns = [earlier.column(column).to_pylist() for column in key]
+                kept = [_row_key(values, range(len(key))) not in keys for values in zip(*columns)]
+                earlier = earlier.filter(pyarrow.array(kept, type=pyarrow.bool_()))
+                if earlier.num_rows:
+                    writer = pyarrow.parquet.ParquetWriter(temp_path, schema or earlier.schema)
+                    writer.write_table(earlier)
+
+            # One row group per chunk, so a large table never has to be held as one Arrow table
+            for chunk in _chunks(rows, WRITE_CHUNK_ROWS):
+                arrow_table = pyarrow.table({column: values for column, values in zip(header, zip(*chunk))}, schema=schema)
+                if writer is None:
+                    writer = pyarrow.parquet.ParquetWriter(temp_path, arrow_table.schema)
+                writer.write_table(arrow_table.cast(writer.schema))
+                count += len(chunk)
+            written = True
+        finally:
+            if writer is not None:
+                writer.close()
+            if not written and os.path.exists(temp_path):
+                os.remove(temp_path)  # A failed write leaves the table as it was
+
+        if writer is not None:
+            os.replace(temp_path, path)
+        elif mode == 'replace' and os.path.exists(path):
+            os.remove(path)  # An empty result replaces the previous table with nothing
+        # The merged part holds everything that was kept from the earlier ones
+        for earlier_path in earlier_parts:
+            os.remove(earlier_path)
+        return count
+
+
+# Writes each table to one SQLite file; append mode with a key replaces rows with the same key
+class SqliteSink:
+    name = 'sqlite'
+
+    def __init__(self, directory=sink_dir):
+        self.path = os.path.join(directory, 'output.sqlite3')
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, table, header, rows, mode='replace', key=None, kinds=None):
+        columns = ', '.join(f'"{column}"' for column in header)
+        key_columns = ', '.join(f'"{column}"' for column in key or [])
+        primary_key = f', PRIMARY KEY ({key_columns})' if key else ''
+        placeholders = ', '.join('?' for _ in header)
+        count = 0
+        with sqlite3.connect(self.path, timeout=30) as conn:
+            if mode == 'replace':
+                conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+            conn.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({columns}{primary_key})')
+            for chunk in _chunks(rows, WRITE_CHUNK_ROWS):
+                conn.executemany(f'INSERT OR REPLACE INTO "{table}" ({columns}) VALUES ({placeholders})', chunk)
+                count += len(chunk)
+        return count
+
+
+LOCAL_SINKS = {sink.name: sink for sink in (CsvSink, ParquetSink, SqliteSink)}
+
+
+# Names of the sinks selected for this run
+def selected_sinks():
+    names = [name.strip().lower() for name in output_sinks.split(',') if name.strip()]
+    unknown = [name for name in names if name != 'sheets' and name not in LOCAL_SINKS]
+    if unknown:
+        raise ValueError(f"Unknown OUTPUT_SINKS {', '.join(unknown)}; choose from sheets, {', '.join(LOCAL_SINKS)}")
+    return names
+
+
+# Whether this output should be written to Google Sheets in this run
+def sheets_enabled(output=None):
+    if 'sheets' not in selected_sinks():
+        return False
+    allowed = [name.strip() for name in sheets_outputs.split(',') if name.strip()]
+    return output is None or not allowed or output in allowed
+
+
+# Write one table to every selected sink.
+# rows is a zero-argument callable returning a fresh iterator of rows, so each sink can stream them.
+# write_sheets is called without arguments when Sheets is selected, since each script writes its tabs its own way.
+# kinds maps the numeric columns to 'float' or 'int', as in RowBatch; the other columns are text.
+def write_output(output, tab_name, header, rows, write_sheets=None, mode='replace', key=None, kinds=None):
+    for name in selected_sinks():
+        if name == 'sheets':
+            if write_sheets is not None and sheets_enabled(output):
+                write_sheets()
+            continue
+        table = table_name(tab_name)
+        with stage(f'{name}.write:{table}') as record:
+            record['rows'] = LOCAL_SINKS[name]().write(table, header, rows(), mode, key, kinds)
+        logging.info(f"Wrote {record['rows']} rows of '{tab_name}' to the {name} sink")
@@ -0,0 +1,68 @@
+from ironsource_client import get_client
+from stats_warehouse import get_warehouse
+from sharded_fetch import sharded, sharding_enabled
+
+# One query covers both the waterfall and the Placement Fill Rate views.
+# adSourceChecks is the denominator of adSourceAvailabilityRate, needed to re-aggregate the rate.
+SUPERSET_BREAKDOWNS = "date,adSource,instance,app,adUnits,mediationGroup"
+SUPERSET_METRICS = "revenue,eCPM,impressions,adSourceAvailabilityRate,adSourceChecks"
+
+# Fields that identify a row of the fill-rate view, i.e. the superset without mediationGroup
+FILLRATE_KEY_FIELDS = ('date', 'providerName', 'instanceName', 'appName', 'adUnits')
+
+
+# Order of the superset rows, the same whether they came from one query or from ad unit shards,
+# so turning sharding on or off does not rewrite the tabs
+SUPERSET_ORDER_FIELDS = ('date', 'appName', 'adUnits', 'providerName', 'instanceName', 'mediationGroup')
+
+
+def _row_order(item):
+    return tuple('' if item.get(field) is None else str(item.get(field)) for field in SUPERSET_ORDER_FIELDS)
+
+
+# Fetch the superset for one app key; whichever script runs second is served from the warehouse.
+# With IRONSOURCE_SHARDED=1 the query is split per ad unit, which keeps each response small.
+def fetch_superset(app_key, start_date, end_date):
+    fetch_range = sharded(get_client().iter_stats) if sharding_enabled else get_client().iter_stats
+    return sorted(get_warehouse().fetch(fetch_range, app_key, start_date, end_date, SUPERSET_BREAKDOWNS, SUPERSET_METRICS), key=_row_order)
+
+
+# Waterfall view: the superset rows as they are
+def waterfall_view(items):
+    return items
+
+
+# Placement Fill Rate view: collapse mediationGroup, re-aggregating every metric correctly
+def fillrate_view(items):
+    groups = {}  # Insertion-ordered, so rows keep the order they were first seen in
+    for item in items:
+        key = tuple(item.get(field, '') for field in FILLRATE_KEY_FIELDS)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {'revenue': 0.0, 'impressions': 0, 'checks': 0.0, 'weighted_rate': 0.0, 'rate_sum': 0.0, 'count': 0}
+        for data in item.get('data', []):
+            rate = data.get('adSourceAvailabilityRate', 0) or 0
+            checks = data.get('adSourceChecks', 0) or 0
+            group['revenue'] += data.get('revenue', 0) or 0
+            group['impressions'] += data.get('impressions', 0) or 0
+            group['checks'] += checks
+            group['weighted_rate'] += rate * checks
+            group['rate_sum'] += rate
+            group['count'] += 1
+
+    view = []
+    for key, group in groups.items():
+        # Revenue and impressions add up; eCPM and availability rate are recomputed from their parts.
+        # Values keep full precision like the API's own, any rounding is left to the sheet's formatting.
+        ecpm = group['revenue'] / group['impressions'] * 1000 if group['impressions'] else 0
+        if group['checks']:
+            rate = group['weighted_rate'] / group['checks']
+        else:
+            rate = group['rate_sum'] / group['count'] if group['count'] else 0
+        view.append(dict(zip(FILLRATE_KEY_FIELDS, key), data=[{
+            'revenue': group['revenue'],
+            'eCPM': ecpm,
+            'impressions': group['impressions'],
+            'adSourceAvailabilityRate': rate
+        }]))
+    return view
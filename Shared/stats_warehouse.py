@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta
+
+# Local store settings
+warehouse_path = os.getenv('STATS_WAREHOUSE_PATH', '.cache/stats.sqlite3')
+settle_days = int(os.getenv('STATS_SETTLE_DAYS', '3'))  # IronSource keeps revising recent days for a while
+max_age_seconds = float(os.getenv('STATS_MAX_AGE_HOURS', '6')) * 3600  # How long an unsettled day may be reused
+offline = os.getenv('IRONSOURCE_OFFLINE', '0') == '1'  # Serve only what is stored, never call the API
+
+
+# Normalize a comma-separated field list so the order it was written in does not matter
+def _field_key(fields):
+    return ','.join(sorted(field.strip() for field in fields.split(',') if field.strip()))
+
+
+# Extract the YYYY-MM-DD date of a stats row
+def _row_date(item):
+    return str(item.get('date', '')).strip("'")[:10]
+
+
+# Every date from start to end inclusive, as YYYY-MM-DD strings
+def date_range(start_date, end_date):
+    day = datetime.strptime(start_date, "%Y-%m-%d").date()
+    end = datetime.strptime(end_date, "%Y-%m-%d").date()
+    dates = []
+    while day <= end:
+        dates.append(day.strftime("%Y-%m-%d"))
+        day += timedelta(days=1)
+    return dates
+
+
+# Group sorted dates into runs of consecutive days, so each run needs one request
+def _consecutive_runs(dates):
+    runs = []
+    for date_str in dates:
+        day = datetime.strptime(date_str, "%Y-%m-%d").date()
+        if runs and datetime.strptime(runs[-1][-1], "%Y-%m-%d").date() + timedelta(days=1) == day:
+            runs[-1].append(date_str)
+        else:
+            runs.append([date_str])
+    return runs
+
+
+# On-disk store of IronSource stats keyed by app key, date, breakdown set and metric set
+class StatsWarehouse:
+    def __init__(self, path=warehouse_path, settle=settle_days, max_age=max_age_seconds, offline=offline):
+        self.path = path
+        self.settle = settle
+        self.max_age = max_age
+        self.offline = offline
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS stats ("
+                " app_key TEXT, date TEXT, breakdowns TEXT, metrics TEXT, payload TEXT, fetched_at REAL,"
+                " PRIMARY KEY (app_key, date, breakdowns, metrics))"
+            )
+
+    # Open a new connection; one per call keeps the store safe to use from the fetch threads
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    # Return {date: (rows, fetched_at)} for the stored dates in the list
+    def load(self, app_key, dates, breakdowns, metrics):
+        if not dates:
+            return {}
+        placeholders = ','.join('?' for _ in dates)
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"SELECT date, payload, fetched_at FROM stats WHERE app_key = ? AND breakdowns = ? AND metrics = ? AND date IN ({placeholders})",
+                [app_key, _field_key(breakdowns), _field_key(metrics)] + list(dates)
+            )
+            return {date_str: (json.loads(payload), fetched_at) for date_str, payload, fetched_at in cursor}
+
+    # Save the rows of each date, replacing what was stored before
+    def store(self, app_key, rows_by_date, breakdowns, metrics, fetched_at=None):
+        fetched_at = fetched_at or time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO stats (app_key, date, breakdowns, metrics, payload, fetched_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(app_key, date_str, _field_key(breakdowns), _field_key(metrics), json.dumps(rows), fetched_at)
+                 for date_str, rows in rows_by_date.items()]
+            )
+
+    # A stored day can be reused if it was fetched after it settled, or recently enough
+    def _is_fresh(self, date_str, fetched_at, now):
+        settled_at = datetime.strptime(date_str, "%Y-%m-%d") + timedelta(days=self.settle)
+        return fetched_at >= settled_at.timestamp() or now - fetched_at < self.max_age
+
+    # Return rows for the date range, calling fetch_range only for missing or still-settling dates
+    def fetch(self, fetch_range, app_key, start_date, end_date, breakdowns, metrics):
+        dates = date_range(start_date, end_date)
+        stored = self.load(app_key, dates, breakdowns, metrics)
+        now = time.time()
+
+        if self.offline:
+            missing = [date_str for date_str in dates if date_str not in stored]
+            if missing:
+                logging.warning(f"Offline mode: no stored data for {app_key} on {', '.join(missing)}")
+            to_fetch = []
+        else:
+            to_fetch = [date_str for date_str in dates
+                        if date_str not in stored or not self._is_fresh(date_str, stored[date_str][1], now)]
+
+        rows_by_date = {date_str: stored[date_str][0] for date_str in dates if date_str in stored}
+        for run in _consecutive_runs(to_fetch):
+            logging.info(f"Fetching {app_key} for {run[0]} to {run[-1]} ({len(dates) - len(to_fetch)} of {len(dates)} days served locally)")
+            fetched = {date_str: [] for date_str in run}  # Days with no rows are stored too
+            for item in fetch_range(app_key, run[0], run[-1], breakdowns, metrics):
+                fetched.setdefault(_row_date(item), []).append(item)
+            self.store(app_key, fetched, breakdowns, metrics)
+            rows_by_date.update(fetched)
+
+        # Return the rows in date order
+        return [item for date_str in sorted(rows_by_date) for item in rows_by_date[date_str]]
+
+
+_warehouse = None
+_warehouse_lock = threading.Lock()
+
+
+# Return the process-wide stats warehouse
+def get_warehouse():
+    global _warehouse
+    with _warehouse_lock:
+        if _warehouse is None:
+            _warehouse = StatsWarehouse()
+        return _warehouse
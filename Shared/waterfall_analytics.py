@@ -0,0 +1,124 @@
+import os
+import numpy as np
+
+from row_batch import RowBatch
+
+# Superset fields the analytics need, as (header, source, field, kind) for a RowBatch
+ANALYTICS_COLUMNS = [
+    ("Date", 'item', 'date', 'str'),
+    ("App Name", 'item', 'appName', 'str'),
+    ("Ad Unit", 'item', 'adUnits', 'str'),
+    ("Mediation Group", 'item', 'mediationGroup', 'str'),
+    ("Ad Source", 'item', 'providerName', 'str'),
+    ("Instance", 'item', 'instanceName', 'str'),
+    ("Revenue", 'data', 'revenue', 'float'),
+    ("eCPM", 'data', 'eCPM', 'float'),
+    ("Impressions", 'data', 'impressions', 'int'),
+    ("Availability Rate", 'data', 'adSourceAvailabilityRate', 'float'),
+    ("Checks", 'data', 'adSourceChecks', 'float')
+]
+
+# One waterfall is the instances of one ad unit in one mediation group of one app on one day
+WATERFALL_FIELDS = ("Date", "App Name", "Ad Unit", "Mediation Group")
+
+# Instances whose availability is this many standard deviations below their waterfall's mean are flagged
+AVAILABILITY_OUTLIER_Z = float(os.getenv('AVAILABILITY_OUTLIER_Z', '1.5'))
+
+RECOMMENDATION_HEADER = [
+    "Date", "App Name", "Ad Unit", "Mediation Group", "Ad Source", "Instance", "Revenue", "eCPM", "Impressions",
+    "Availability Rate", "Revenue Share", "Availability Z", "Impressions Rank", "Suggested Tier", "Action"
+]
+RECOMMENDATION_KINDS = {
+    "Revenue": 'float', "eCPM": 'float', "Impressions": 'int', "Availability Rate": 'float', "Revenue Share": 'float',
+    "Availability Z": 'float', "Impressions Rank": 'int', "Suggested Tier": 'int'
+}
+
+
+# Rank of every row within its group, 1 for the highest value
+def _rank_within(groups, values):
+    order = np.lexsort((-values, groups))
+    sorted_groups = groups[order]
+    # sorted_groups is sorted, so each row's group starts at the first occurrence of its id
+    group_start = np.searchsorted(sorted_groups, sorted_groups, side='left')
+    ranks = np.empty(len(values), dtype=np.int64)
+    ranks[order] = np.arange(len(values)) - group_start + 1
+    return ranks, order
+
+
+# Per-row metrics of every waterfall in the superset rows, as NumPy arrays
+def analyze(items):
+    batch = RowBatch(ANALYTICS_COLUMNS)
+    batch.extend(items)
+
+    revenue = np.asarray(batch.column("Revenue"), dtype=np.float64)
+    ecpm = np.asarray(batch.column("eCPM"), dtype=np.float64)
+    impressions = np.asarray(batch.column("Impressions"), dtype=np.int64)
+    rate = np.asarray(batch.column("Availability Rate"), dtype=np.float64)
+    checks = np.asarray(batch.column("Checks"), dtype=np.float64)
+
+    # Number the waterfalls
+    keys = np.array(['\x1f'.join(map(str, key)) for key in zip(*(batch.column(field) for field in WATERFALL_FIELDS))], dtype=object)
+    _, groups = np.unique(keys, return_inverse=True)
+    groups = groups.astype(np.int64).reshape(-1)
+    group_count = int(groups.max()) + 1 if len(groups) else 0
+
+    # Revenue share of each instance in its waterfall
+    group_revenue = np.bincount(groups, weights=revenue, minlength=group_count)[groups]
+    revenue_share = np.divide(revenue, group_revenue, out=np.zeros_like(revenue), where=group_revenue > 0)
+
+    # eCPM rank is the suggested tier; the impressions rank stands in for the current one,
+    # since instances higher up a waterfall see the traffic first
+    ecpm_rank, order = _rank_within(groups, ecpm)
+    impressions_rank, _ = _rank_within(groups, impressions.astype(np.float64))
+
+    # Checks-weighted availability z-score within the waterfall
+    weights = np.where(checks > 0, checks, 1.0)
+    weight_sum = np.bincount(groups, weights=weights, minlength=group_count)
+    mean = (np.bincount(groups, weights=weights * rate, minlength=group_count) / np.maximum(weight_sum, 1e-12))[groups]
+    variance = np.bincount(groups, weights=weights * (rate - mean) ** 2, minlength=group_count) / np.maximum(weight_sum, 1e-12)
+    std = np.sqrt(variance)[groups]
+    availability_z = np.divide(rate - mean, std, out=np.zeros_like(rate), where=std > 0)
+
+    return {
+        'batch': batch,
+        'order': order,  # Rows by waterfall, then by suggested tier
+        'revenue': revenue,
+        'ecpm': ecpm,
+        'impressions': impressions,
+        'rate': rate,
+        'ecpm_rank': ecpm_rank,
+        'impressions_rank': impressions_rank,
+        'tier_shift': impressions_rank - ecpm_rank,  # Positive: the instance should move up that many tiers
+        'revenue_share': revenue_share,
+        'availability_z': availability_z,
+        'availability_outlier': availability_z <= -AVAILABILITY_OUTLIER_Z,
+    }
+
+
+# Recommendations tab rows, header first, ordered by waterfall and suggested tier
+def recommendation_rows(items):
+    result = analyze(items)
+    batch = result['batch']
+    strings = [batch.column(header) for header in RECOMMENDATION_HEADER[:6]]
+
+    yield RECOMMENDATION_HEADER
+    for i in result['order'].tolist():
+        shift = int(result['tier_shift'][i])
+        actions = []
+        if shift > 0:
+            actions.append(f"move up {shift}")
+        elif shift < 0:
+            actions.append(f"move down {-shift}")
+        if result['availability_outlier'][i]:
+            actions.append("low availability")
+        yield [column[i] for column in strings] + [
+            round(float(result['revenue'][i]), 2),
+            round(float(result['ecpm'][i]), 2),
+            int(result['impressions'][i]),
+            round(float(result['rate'][i]), 2),
+            round(float(result['revenue_share'][i]), 4),
+            round(float(result['availability_z'][i]), 2),
+            int(result['impressions_rank'][i]),
+            int(result['ecpm_rank'][i]),
+            ', '.join(actions)
+        ]
@@ -1,40 +1,159 @@
 import os
+import sys
+import logging
+import threading
+from datetime import datetime, timedelta
 import requests
+from requests.adapters import HTTPAdapter
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Shared'))
+from request_scheduler import scheduled_request
+from run_metrics import stage, timing_line, load_run_metrics
+from run_summary import load_run_summary, set_slack_message
 
 # Load environment variables
 slack_token = os.getenv('SLACK_API_TOKEN')
 slack_channel = os.getenv('SLACK_CHANNEL_ID')
+slack_api_url = os.getenv('SLACK_API_URL', 'https://slack.com/api')
 
-# Path to summary.txt in the Summary folder
-summary_file_path = 'Summary/summary.txt'
+# One message per report day: a re-triggered workflow updates the day's message instead of posting another.
+# The message carries the key in its metadata, so it is found again from a fresh runner.
+report_key = os.getenv('SLACK_REPORT_KEY') or datetime.now().strftime('%Y-%m-%d')
+METADATA_EVENT_TYPE = 'waterfall_daily_run'
 
-# Function to send the message to Slack
-def send_slack_message(message):
-    url = "https://slack.com/api/chat.postMessage"
-    headers = {
-        "Authorization": f"Bearer {slack_token}",
-        "Content-Type": "application/json"
-    }
-    data = {
+# Recent messages searched for the day's earlier post
+HISTORY_LIMIT = 200
+
+# Block Kit limits
+SECTION_TEXT_LIMIT = 3000
+MAX_BLOCKS = 50
+
+STATUS_ICONS = {'ok': ':white_check_mark:', 'error': ':x:'}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+# Return the process-wide keep-alive session for the Slack Web API
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.headers.update({"Authorization": f"Bearer {slack_token}"})
+            _session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        return _session
+
+
+# Check a Slack Web API response, which reports most errors as {"ok": false} with status 200
+def _result(method, response):
+    response.raise_for_status()
+    data = response.json()
+    if not data.get('ok'):
+        raise RuntimeError(f"Slack {method} failed: {data.get('error')}")
+    return data
+
+
+# Call a Slack Web API method with a JSON body; the request scheduler retries 429 and 5xx responses,
+# or only 429 and unsent requests for a method that is not idempotent such as chat.postMessage
+def slack_post(method, payload, idempotent=True):
+    return _result(method, scheduled_request('slack', get_session().post, f"{slack_api_url}/{method}",
+                                             json=payload, idempotent=idempotent))
+
+
+# Call a read method of the Slack Web API, which takes query parameters rather than JSON
+def slack_get(method, params):
+    return _result(method, scheduled_request('slack', get_session().get, f"{slack_api_url}/{method}", params=params))
+
+
+# One section per step, e.g. ":white_check_mark: *fillrate* · 2,000 rows · 4.2s" with its links and notes below
+def step_text(step, entry, metrics):
+    details = [f"{STATUS_ICONS.get(entry['status'], ':grey_question:')} *{step}*"]
+    if entry['rows']:
+        details.append(f"{entry['rows']:,} rows")
+    if metrics:
+        details.append(f"{metrics['total_seconds']:.1f}s")
+    lines = [' · '.join(details)]
+    if entry.get('error'):
+        lines.append(f"Error: {entry['error']}")
+    if entry['links']:
+        lines.append('  '.join(f"<{link['url']}|{link['label']}>" for link in entry['links']))
+    lines.extend(entry['notes'])
+    return '\n'.join(lines)[:SECTION_TEXT_LIMIT]
+
+
+# Block Kit blocks of the run summary
+def build_blocks(summary, metrics):
+    blocks = [{"type": "header", "text": {"type": "plain_text", "text": f"Daily run {report_key}"}}]
+    for step, entry in summary['steps'].items():
+        blocks.append({"type": "section", "text": {"type": "mrkdwn", "text": step_text(step, entry, metrics.get(step))}})
+    if not summary['steps']:
+        blocks.append({"type": "section", "text": {"type": "mrkdwn", "text": "No summary available yet."}})
+
+    # Per-stage timings from Summary/metrics.json when this run recorded them
+    timing = timing_line()
+    if timing:
+        blocks = blocks[:MAX_BLOCKS - 1]
+        blocks.append({"type": "context", "elements": [{"type": "mrkdwn", "text": timing[:SECTION_TEXT_LIMIT]}]})
+    return blocks[:MAX_BLOCKS]
+
+
+# Plain-text fallback for notifications, e.g. "Daily run 2024-01-02: 3 of 4 steps ok, failed: dailyrev"
+def fallback_text(summary):
+    steps = summary['steps']
+    failed = [step for step, entry in steps.items() if entry['status'] != 'ok']
+    text = f"Daily run {report_key}: {len(steps) - len(failed)} of {len(steps)} steps ok"
+    return f"{text}, failed: {', '.join(failed)}" if failed else text
+
+
+# ts of the day's earlier message, from this run's summary or else from the channel history
+def find_report_message(summary):
+    saved = summary.get('slack') or {}
+    if saved.get('key') == report_key:
+        return saved['ts']
+    try:
+        data = slack_get('conversations.history', {
+            'channel': slack_channel,
+            'oldest': f"{(datetime.now() - timedelta(days=1)).timestamp():.0f}",
+            'limit': HISTORY_LIMIT,
+            'include_all_metadata': 'true'
+        })
+    except (requests.RequestException, RuntimeError, ValueError) as e:
+        logging.warning(f"Could not read the Slack history, posting a new message: {e}")
+        return None
+    for message in data.get('messages', []):
+        metadata = message.get('metadata') or {}
+        if metadata.get('event_type') == METADATA_EVENT_TYPE and metadata.get('event_payload', {}).get('report') == report_key:
+            return message['ts']
+    return None
+
+
+# Main function to send the run summary as one Slack message, or update the one already sent for the day
+def main():
+    summary = load_run_summary()
+    message = {
         "channel": slack_channel,
-        "text": message
+        "text": fallback_text(summary),
+        "blocks": build_blocks(summary, load_run_metrics()['scripts']),
+        "metadata": {"event_type": METADATA_EVENT_TYPE, "event_payload": {"report": report_key, "run_id": summary['run_id']}}
     }
 
-    response = requests.post(url, headers=headers, json=data)
-    if response.status_code == 200:
-        print("Message sent successfully to Slack")
-    else:
-        print(f"Failed to send message: {response.status_code}, {response.text}")
-
-# Read the content from summary.txt or create the file if missing
-def read_summary():
-    if not os.path.exists(summary_file_path):
-        with open(summary_file_path, 'w') as file:
-            file.write("No summary available yet.\n")
-    with open(summary_file_path, 'r') as file:
-        return file.read()
-
-# Main function to send the message
+    try:
+        with stage('slack.send'):
+            ts = find_report_message(summary)
+            if ts is not None:
+                try:
+                    slack_post('chat.update', dict(message, ts=ts))
+                    print("Message updated successfully in Slack")
+                except RuntimeError as e:
+                    logging.warning(f"Could not update the earlier Slack message, posting a new one: {e}")
+                    ts = None
+            if ts is None:
+                ts = slack_post('chat.postMessage', message, idempotent=False)['ts']
+                print("Message sent successfully to Slack")
+        set_slack_message(report_key, ts)
+    except (requests.RequestException, RuntimeError, ValueError) as e:
+        print(f"Failed to send message: {e}")
+
 if __name__ == "__main__":
-    summary_message = read_summary()
-    send_slack_message(summary_message)
+    main()
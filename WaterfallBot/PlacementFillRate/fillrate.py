@@ -1,21 +1,31 @@
 import os
+import sys
 import requests
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 import logging
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Shared'))
+from parallel_fetch import fetch_platforms
+from stats_pipeline import fetch_superset, fillrate_view
+from sheet_writer import write_incremental
+from row_batch import RowBatch
+from request_scheduler import scheduled
+from google_clients import open_spreadsheet
+from app_config import load_apps, apps_by_tab
+from rolling_stats import record_and_report, instance_observations
+from sinks import write_output, sheets_enabled
+from checkpoint import Checkpoint
+from run_metrics import stage, flush
+from run_summary import step_status, add_rows, add_link
+
 # Load environment variables
 load_dotenv()
 
 # Fetch environment variables
-secret_key = os.getenv('IRONSOURCE_SECRET_KEY')
-refresh_token = os.getenv('IRONSOURCE_REFRESH_TOKEN')
 sheet_id = os.getenv('GOOGLE_SHEET_ID')
+sheet_url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/edit"
 credentials_file = 'WaterfallBot/google-credentials.json'
-app_key_ios = os.getenv('IRONSOURCE_APP_KEY_IOS')
-app_key_android = os.getenv('IRONSOURCE_APP_KEY_ANDROID')
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -24,43 +34,13 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 yesterday = datetime.now() - timedelta(days=1)
 yesterday_str = yesterday.strftime("%Y-%m-%d")
 
-# Function to get Bearer Token with GET request
-def get_bearer_token():
-    try:
-        url = "https://platform.ironsrc.com/partners/publisher/auth"
-        headers = {
-            "secretKey": secret_key,
-            "refreshToken": refresh_token
-        }
-        
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()  # Raise an error if the request fails
-        return response.text.strip('"')  # Extract and return the Bearer token
-    except requests.RequestException as e:
-        logging.error(f"Failed to get Bearer Token: {e}")
-        raise
-
 # Fetch data from IronSource API with the correct field names
 def fetch_ironsource_data(app_key, start_date, end_date):
     try:
-        bearer_token = get_bearer_token()
-        url = f"https://platform.ironsrc.com/partners/publisher/mediation/applications/v6/stats"
-        headers = {"Authorization": f"Bearer {bearer_token}"}
-        
-        params = {
-            "startDate": start_date,
-            "endDate": end_date,
-            "breakdowns": "date,adSource,instance,app,adUnits",
-            "metrics": "revenue,eCPM,impressions,adSourceAvailabilityRate",
-            "appKey": app_key
-        }
-        
-        logging.info(f"Fetching data for {app_key} from {start_date} to {end_date} with params: {params}")
+        logging.info(f"Fetching data for {app_key} from {start_date} to {end_date}")
         
-        response = requests.get(url, headers=headers, params=params)
-        response.raise_for_status()
-        
-        return response.json()  # Return the JSON response
+        # fillrate.py and waterfall.py share one superset query, so only the first of them calls the API
+        return fillrate_view(fetch_superset(app_key, start_date, end_date))
     except requests.RequestException as e:
         logging.error(f"Failed to fetch data for appKey {app_key} from {start_date} to {end_date}: {e}")
         return []
@@ -70,83 +50,113 @@ def find_next_available_row(sheet):
     str_list = list(filter(None, sheet.col_values(2)))  # Assuming Column 2 (B) is always populated with Date values
     return len(str_list) + 1  # Return the next empty row
 
-# Fill Google Sheets with IronSource data for both iOS and Android using batch updates
-def fill_google_sheets(sheet, ironsource_data_ios, ironsource_data_android):
-    # Clear the range B1:J to remove any previous data
-    sheet.update('B1:J', [['' for _ in range(9)] for _ in range(sheet.row_count)])  # Clear the content of range B1:J
+# Sheet columns B:J as (header, source, field, kind)
+SHEET_COLUMNS = [
+    ("Date", 'item', 'date', 'str'),                                     # Column B
+    ("Ad Source", 'item', 'providerName', 'str'),                        # Column C
+    ("Instance", 'item', 'instanceName', 'str'),                         # Column D
+    ("App Name", 'item', 'appName', 'str'),                              # Column E
+    ("Ad Unit", 'item', 'adUnits', 'str'),                               # Column F
+    ("Revenue", 'data', 'revenue', 'float'),                             # Column G
+    ("eCPM", 'data', 'eCPM', 'float'),                                   # Column H
+    ("Impressions", 'data', 'impressions', 'int'),                       # Column I
+    ("Availability Rate", 'data', 'adSourceAvailabilityRate', 'float')   # Column J
+]
 
-    # Insert the header row in B1:J1
-    header = ["Date", "Ad Source", "Instance", "App Name", "Ad Unit", "Revenue", "eCPM", "Impressions", "Availability Rate"]
-    sheet.update('B1:J1', [header])
-    
-    # Prepare data for batch update
-    batch_data = []
-    
-    # Prepare iOS data
-    for item in ironsource_data_ios:
-        for data in item.get('data', []):  # Ensure 'data' field exists
-            batch_data.append([
-                item.get('date', ''),                        # Date in Column B
-                item.get('providerName', ''),                # Ad Source in Column C
-                item.get('instanceName', ''),                # Instance in Column D
-                item.get('appName', ''),                     # App Name in Column E
-                item.get('adUnits', ''),                     # Ad Unit in Column F
-                data.get('revenue', 0),                      # Revenue in Column G
-                data.get('eCPM', 0),                         # eCPM in Column H
-                data.get('impressions', 0),                  # Impressions in Column I
-                data.get('adSourceAvailabilityRate', 0)      # Availability Rate in Column J
-            ])
-    
-    # Prepare Android data
-    for item in ironsource_data_android:
-        for data in item.get('data', []):  # Ensure 'data' field exists
-            batch_data.append([
-                item.get('date', ''),                        # Date in Column B
-                item.get('providerName', ''),                # Ad Source in Column C
-                item.get('instanceName', ''),                # Instance in Column D
-                item.get('appName', ''),                     # App Name in Column E
-                item.get('adUnits', ''),                     # Ad Unit in Column F
-                data.get('revenue', 0),                      # Revenue in Column G
-                data.get('eCPM', 0),                         # eCPM in Column H
-                data.get('impressions', 0),                  # Impressions in Column I
-                data.get('adSourceAvailabilityRate', 0)      # Availability Rate in Column J
-            ])
-    
-    # Batch update the sheet starting from B2:J
-    if batch_data:
-        sheet.update(f'B2:J{1 + len(batch_data)}', batch_data)
+# Collect every app's rows of a tab into one columnar batch, in config order
+def build_batch(datasets):
+    with stage('transform') as record:
+        batch = RowBatch(SHEET_COLUMNS)
+        for data in datasets:
+            batch.extend(data)
+        record['rows'] = len(batch)
+    return batch
+
+# Fill Google Sheets with the rows of the batch using batch updates
+def fill_google_sheets(sheet, batch, incremental=True):
+    header = batch.header()
+    batch_data = list(batch.iter_rows())
+
+    # Send only the rows that differ from the current B:J block
+    if incremental:
+        write_incremental(sheet, [header] + batch_data, 'B', 'J')
+        return
+
+    # Full rewrite: clear the range B1:J to remove any previous data
+    with stage(f'sheets.clear:{sheet.title}'):
+        scheduled('sheets', sheet.update, 'B1:J', [['' for _ in range(9)] for _ in range(sheet.row_count)])  # Clear the content of range B1:J
+
+    with stage(f'sheets.write:{sheet.title}', rows=len(batch_data)):
+        # Insert the header row in B1:J1
+        scheduled('sheets', sheet.update, 'B1:J1', [header])
+
+        # Batch update the sheet starting from B2:J
+        if batch_data:
+            scheduled('sheets', sheet.update, f'B2:J{1 + len(batch_data)}', batch_data)
 
 
 # Setup Google Sheets API
-def setup_google_sheets(sheet_id, credentials_file):
-    scope = ["https://spreadsheets.google.com/feeds", 'https://www.googleapis.com/auth/drive']
-    creds = ServiceAccountCredentials.from_json_keyfile_name(credentials_file, scope)
-    client = gspread.authorize(creds)
-    return client.open_by_key(sheet_id).worksheet('Placement Fill Rate')  # Open specific tab
+def setup_google_sheets(sheet_id, credentials_file, tab_name):
+    # The client and spreadsheet are shared with the other scripts when they run in one process
+    spreadsheet = open_spreadsheet(sheet_id, credentials_file)
+    with stage('sheets.open'):
+        return scheduled('sheets', spreadsheet.worksheet, tab_name)  # Open specific tab
 
-# Main function to automate the process for both iOS and Android
+# Main function to automate the process for every configured app
 def main():
     # Fetch IronSource data for yesterday
     start_date = yesterday_str
     end_date = start_date
+    apps = load_apps('fillrate')
+
+    # A re-run of a failed run reuses its completed fetches and skips the tabs it already wrote
+    checkpoint = Checkpoint('fillrate')
     
-    # Fetch iOS data
-    ironsource_data_ios = fetch_ironsource_data(app_key_ios, start_date, end_date)
-    logging.info(f"iOS Data: {ironsource_data_ios}")  # Log fetched iOS data
-    
-    # Fetch Android data
-    ironsource_data_android = fetch_ironsource_data(app_key_android, start_date, end_date)
-    logging.info(f"Android Data: {ironsource_data_android}")  # Log fetched Android data
-    
-    if ironsource_data_ios and ironsource_data_android:
-        # Google Sheets setup
-        gather_sheet = setup_google_sheets(sheet_id, credentials_file)
-        
-        # Fill Google Sheets with IronSource data for both iOS and Android
-        fill_google_sheets(gather_sheet, ironsource_data_ios, ironsource_data_android)
-    else:
-        logging.warning("No data to insert into Google Sheets")
+    # Fetch every app concurrently, up to IRONSOURCE_MAX_WORKERS at a time
+    with stage('fetch') as record:
+        ironsource_data = fetch_platforms(checkpoint.fetcher(fetch_ironsource_data), {app['name']: app['app_key'] for app in apps}, start_date, end_date)
+        record['rows'] = sum(len(data) for data in ironsource_data.values())
+
+    # Log row counts; the full payloads are formatted lazily and only at DEBUG
+    for app in apps:
+        logging.info("%s Data: %d rows", app['name'], len(ironsource_data.get(app['name'], [])))
+        logging.debug("%s Data: %s", app['name'], ironsource_data.get(app['name'], []))
+
+    # Add the day to each instance's rolling statistics and report eCPM, revenue or availability drops in the summary
+    with stage('anomalies') as record:
+        record['anomalies'] = len(record_and_report('instance', (observation for data in ironsource_data.values() for observation in instance_observations(data)), 'fillrate'))
+
+    # One write per tab; a tab is left as it is when any of its apps has no data, so it never shows a partial day
+    skipped = False
+    for tab_name, tab_apps in apps_by_tab(apps, 'fillrate', 'Placement Fill Rate').items():
+        missing = [app['name'] for app in tab_apps if not ironsource_data.get(app['name'])]
+        if missing:
+            logging.warning(f"No data for {', '.join(missing)}; not updating '{tab_name}'")
+            skipped = True
+            continue
+        if checkpoint.done(f'write:{tab_name}'):
+            logging.info(f"'{tab_name}' was already written in this run")
+            continue
+
+        batch = build_batch([ironsource_data[app['name']] for app in tab_apps])
+
+        # Fill Google Sheets with IronSource data for every app of the tab, and write any local sinks selected in OUTPUT_SINKS
+        write_output('fillrate', tab_name, batch.header(), batch.iter_rows, lambda: fill_google_sheets(
+            setup_google_sheets(sheet_id, credentials_file, tab_name), batch, incremental=os.getenv('FILLRATE_INCREMENTAL', '1') != '0'
+        ), kinds=batch.kinds())
+        checkpoint.complete(f'write:{tab_name}')
+        add_rows('fillrate', len(batch))
+        if sheets_enabled('fillrate'):
+            add_link('fillrate', tab_name, sheet_url)
+
+    # Keep the checkpoint while a tab is missing data, so the re-run fetches only the apps that failed
+    if not skipped:
+        checkpoint.finish()
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        with step_status('fillrate'):  # Record the outcome for the Slack summary
+            main()
+    finally:
+        flush('fillrate')  # Record stage timings and API counts in Summary/metrics.json
@@ -1,21 +1,35 @@
 import os
+import sys
 import requests
 import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
+from itertools import chain
 import logging
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Shared'))
+from parallel_fetch import fetch_platforms
+from stats_pipeline import fetch_superset, waterfall_view
+from sheet_writer import write_replace
+from row_batch import RowBatch
+from request_scheduler import scheduled
+from google_clients import open_spreadsheet
+from waterfall_analytics import recommendation_rows, RECOMMENDATION_KINDS
+from app_config import load_apps, apps_by_tab
+from sinks import write_output, sheets_enabled
+from checkpoint import Checkpoint
+from run_metrics import stage, flush
+from run_summary import step_status, add_rows, add_link
+
 # Load environment variables
 load_dotenv()
 
 # Fetch environment variables
-secret_key = os.getenv('IRONSOURCE_SECRET_KEY')
-refresh_token = os.getenv('IRONSOURCE_REFRESH_TOKEN')
 sheet_id = os.getenv('GOOGLE_SHEET_ID')
+sheet_url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/edit"
 credentials_file = 'WaterfallBot/google-credentials.json'
-app_key_ios = os.getenv('IRONSOURCE_APP_KEY_IOS')
-app_key_android = os.getenv('IRONSOURCE_APP_KEY_ANDROID')
+recommendations_tab = os.getenv('GOOGLE_SHEET_RECOMMENDATIONS_TAB', 'Recommendations')
+recommendations_enabled = os.getenv('WATERFALL_RECOMMENDATIONS', '1') != '0'
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -24,43 +38,13 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 yesterday = datetime.now() - timedelta(days=1)
 yesterday_str = yesterday.strftime("%Y-%m-%d")
 
-# Function to get Bearer Token with GET request
-def get_bearer_token():
-    try:
-        url = "https://platform.ironsrc.com/partners/publisher/auth"
-        headers = {
-            "secretKey": secret_key,
-            "refreshToken": refresh_token
-        }
-        
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()  # Raise an error if the request fails
-        return response.text.strip('"')  # Extract and return the Bearer token
-    except requests.RequestException as e:
-        logging.error(f"Failed to get Bearer Token: {e}")
-        raise
-
 # Fetch data from IronSource API with the correct field names
 def fetch_ironsource_data(app_key, start_date, end_date):
     try:
-        bearer_token = get_bearer_token()
-        url = f"https://platform.ironsrc.com/partners/publisher/mediation/applications/v6/stats"
-        headers = {"Authorization": f"Bearer {bearer_token}"}
-        
-        params = {
-            "startDate": start_date,
-            "endDate": end_date,
-            "breakdowns": "date,adSource,instance,app,adUnits,mediationGroup",
-            "metrics": "revenue,eCPM,impressions",
-            "appKey": app_key
-        }
-        
-        logging.info(f"Fetching data for {app_key} from {start_date} to {end_date} with params: {params}")
+        logging.info(f"Fetching data for {app_key} from {start_date} to {end_date}")
         
-        response = requests.get(url, headers=headers, params=params)
-        response.raise_for_status()
-        
-        return response.json()  # Return the JSON response
+        # fillrate.py and waterfall.py share one superset query, so only the first of them calls the API
+        return waterfall_view(fetch_superset(app_key, start_date, end_date))
     except requests.RequestException as e:
         logging.error(f"Failed to fetch data for appKey {app_key} from {start_date} to {end_date}: {e}")
         return []
@@ -70,84 +54,120 @@ def find_next_available_row(sheet):
     str_list = list(filter(None, sheet.col_values(2)))  # Assuming Column 2 (B) is always populated with Date values
     return len(str_list) + 1  # Return the next empty row
 
-# Fill Google Sheets with IronSource data for both iOS and Android
-def fill_google_sheets(sheet, ironsource_data_ios, ironsource_data_android):
-    # Define the range to clear: 'B1:J1000' (or any large enough range)
-    range_to_clear = 'B1:J1000'  # Specify a range large enough to cover the data you expect
-    cell_range = sheet.range(range_to_clear)
-    
-    # Clear the values in the specified range
-    for cell in cell_range:
-        cell.value = ''
-    sheet.update_cells(cell_range)  # Update the cleared range
-    
-    # Insert the header row in B1:J1
-    header = ["Date", "Ad Source", "Instance", "App Name", "Mediation Group", "Ad Unit", "Revenue", "eCPM", "Impressions"]
-    sheet.update('B1:J1', [header])
-
-    # Prepare data for batch update
-    batch_data = []
-
-    # Prepare iOS data
-    for item in ironsource_data_ios:
-        for data in item.get('data', []):  # Ensure 'data' field exists
-            batch_data.append([
-                item.get('date', ''),                        # Date in Column B
-                item.get('providerName', ''),                # Ad Source in Column C
-                item.get('instanceName', ''),                # Instance in Column D
-                item.get('appName', ''),                     # App Name in Column E
-                item.get('mediationGroup', ''),              # Mediation Group in Column F
-                item.get('adUnits', ''),                     # Ad Unit in Column G
-                data.get('revenue', 0),                      # Revenue in Column H
-                data.get('eCPM', 0),                         # eCPM in Column I
-                data.get('impressions', 0)                   # Impressions in Column J
-            ])
-
-    # Prepare Android data
-    for item in ironsource_data_android:
-        for data in item.get('data', []):  # Ensure 'data' field exists
-            batch_data.append([
-                item.get('date', ''),                        # Date in Column B
-                item.get('providerName', ''),                # Ad Source in Column C
-                item.get('instanceName', ''),                # Instance in Column D
-                item.get('appName', ''),                     # App Name in Column E
-                item.get('mediationGroup', ''),              # Mediation Group in Column F
-                item.get('adUnits', ''),                     # Ad Unit in Column G
-                data.get('revenue', 0),                      # Revenue in Column H
-                data.get('eCPM', 0),                         # eCPM in Column I
-                data.get('impressions', 0)                   # Impressions in Column J
-            ])
-
-    # Batch update the sheet starting from B2:J
-    if batch_data:
-        sheet.update(f'B2:J{1 + len(batch_data)}', batch_data)
+# Sheet columns B:J as (header, source, field, kind)
+SHEET_COLUMNS = [
+    ("Date", 'item', 'date', 'str'),                     # Column B
+    ("Ad Source", 'item', 'providerName', 'str'),        # Column C
+    ("Instance", 'item', 'instanceName', 'str'),         # Column D
+    ("App Name", 'item', 'appName', 'str'),              # Column E
+    ("Mediation Group", 'item', 'mediationGroup', 'str'),  # Column F
+    ("Ad Unit", 'item', 'adUnits', 'str'),               # Column G
+    ("Revenue", 'data', 'revenue', 'float'),             # Column H
+    ("eCPM", 'data', 'eCPM', 'float'),                   # Column I
+    ("Impressions", 'data', 'impressions', 'int')        # Column J
+]
+
+# Collect every app's rows of a tab into one columnar batch, in config order
+def build_batch(datasets):
+    with stage('transform') as record:
+        batch = RowBatch(SHEET_COLUMNS)
+        for data in datasets:
+            batch.extend(data)
+        record['rows'] = len(batch)
+    return batch
+
+# Fill Google Sheets with the rows of the batch
+def fill_google_sheets(sheet, batch):
+    # Write the header and rows to B1:J, then clear whatever the previous run left below them
+    write_replace(sheet, chain([batch.header()], batch.iter_rows()), 'B', 'J', total_rows=len(batch) + 1)
+
+
+# Rank instances, flag availability outliers and suggest tier moves; the header comes first
+def build_recommendations(datasets):
+    with stage('analytics') as record:
+        rows = list(recommendation_rows(chain.from_iterable(datasets)))
+        record['rows'] = len(rows) - 1
+    return rows
+
+# Write the recommendations to their tab
+def write_recommendations(sheet_id, credentials_file, rows):
+    spreadsheet = open_spreadsheet(sheet_id, credentials_file)
+    with stage('sheets.open'):
+        try:
+            sheet = scheduled('sheets', spreadsheet.worksheet, recommendations_tab)
+        except gspread.exceptions.WorksheetNotFound:
+            sheet = scheduled('sheets', spreadsheet.add_worksheet, recommendations_tab, rows=max(1000, len(rows)), cols=16,
+                              idempotent=False)
+
+    # Header and rows in B:P, then clear whatever the previous run left below them
+    write_replace(sheet, rows, 'B', 'P')
 
 
 # Setup Google Sheets API
 def setup_google_sheets(sheet_id, credentials_file, tab_name):
-    scope = ["https://spreadsheets.google.com/feeds", 'https://www.googleapis.com/auth/drive']
-    creds = ServiceAccountCredentials.from_json_keyfile_name(credentials_file, scope)
-    client = gspread.authorize(creds)
-    return client.open_by_key(sheet_id).worksheet(tab_name)  # Open the tab using the provided name
+    # The client and spreadsheet are shared with the other scripts when they run in one process
+    spreadsheet = open_spreadsheet(sheet_id, credentials_file)
+    with stage('sheets.open'):
+        return scheduled('sheets', spreadsheet.worksheet, tab_name)  # Open the tab using the provided name
 
-# Main function to automate the process for both iOS and Android
+# Main function to automate the process for every configured app
 def main():
     # Fetch IronSource data for yesterday
     start_date = yesterday_str
     end_date = start_date
+    apps = load_apps('waterfall')
+
+    # A re-run of a failed run reuses its completed fetches and skips the tabs it already wrote
+    checkpoint = Checkpoint('waterfall')
     
-    # Fetch iOS and Android data
-    ironsource_data_ios = fetch_ironsource_data(app_key_ios, start_date, end_date)
-    ironsource_data_android = fetch_ironsource_data(app_key_android, start_date, end_date)
-    
-    if ironsource_data_ios and ironsource_data_android:
-        # Google Sheets setup with environment variable for tab name
-        gather_sheet = setup_google_sheets(sheet_id, credentials_file, os.getenv('GOOGLE_SHEET_WATERFALL_TAB'))
-        
-        # Fill Google Sheets with IronSource data
-        fill_google_sheets(gather_sheet, ironsource_data_ios, ironsource_data_android)
-    else:
-        logging.warning("No data to insert into Google Sheets")
+    # Fetch every app concurrently, up to IRONSOURCE_MAX_WORKERS at a time
+    with stage('fetch') as record:
+        ironsource_data = fetch_platforms(checkpoint.fetcher(fetch_ironsource_data), {app['name']: app['app_key'] for app in apps}, start_date, end_date)
+        record['rows'] = sum(len(data) for data in ironsource_data.values())
+
+    # One write per tab; a tab is left as it is when any of its apps has no data, so it never shows a partial day
+    written = []
+    skipped = False
+    for tab_name, tab_apps in apps_by_tab(apps, 'waterfall', os.getenv('GOOGLE_SHEET_WATERFALL_TAB')).items():
+        missing = [app['name'] for app in tab_apps if not ironsource_data.get(app['name'])]
+        if missing:
+            logging.warning(f"No data for {', '.join(missing)}; not updating '{tab_name}'")
+            skipped = True
+            continue
+
+        datasets = [ironsource_data[app['name']] for app in tab_apps]
+        written.extend(datasets)
+        if checkpoint.done(f'write:{tab_name}'):
+            logging.info(f"'{tab_name}' was already written in this run")
+            continue
+        batch = build_batch(datasets)
+
+        # Fill Google Sheets with IronSource data, using the tab name from the config or the environment variable by default,
+        # and write any local sinks selected in OUTPUT_SINKS
+        write_output('waterfall', tab_name, batch.header(), batch.iter_rows, lambda: fill_google_sheets(
+            setup_google_sheets(sheet_id, credentials_file, tab_name), batch
+        ), kinds=batch.kinds())
+        checkpoint.complete(f'write:{tab_name}')
+        add_rows('waterfall', len(batch))
+        if sheets_enabled('waterfall'):
+            add_link('waterfall', tab_name, sheet_url)
+
+    # One recommendations tab across every app whose waterfall was written
+    if recommendations_enabled and written and not checkpoint.done('write:recommendations'):
+        rows = build_recommendations(written)
+        write_output('recommendations', recommendations_tab, rows[0], lambda: iter(rows[1:]),
+                     lambda: write_recommendations(sheet_id, credentials_file, rows), kinds=RECOMMENDATION_KINDS)
+        checkpoint.complete('write:recommendations')
+        if sheets_enabled('recommendations'):
+            add_link('waterfall', recommendations_tab, sheet_url)
+
+    # Keep the checkpoint while a tab is missing data, so the re-run fetches only the apps that failed
+    if not skipped:
+        checkpoint.finish()
 
 if __name__ == "__main__":
-    main()
+    try:
+        with step_status('waterfall'):  # Record the outcome for the Slack summary
+            main()
+    finally:
+        flush('waterfall')  # Record stage timings and API counts in Summary/metrics.json
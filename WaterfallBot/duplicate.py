@@ -1,10 +1,14 @@
 import os
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+import sys
 from datetime import datetime
-from googleapiclient.discovery import build
 from dotenv import load_dotenv
-import requests
+import logging
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Shared'))
+from request_scheduler import scheduled
+from run_metrics import stage, flush
+from google_clients import get_drive_service
+from run_summary import step_status, add_link
 
 # Load environment variables
 load_dotenv()
@@ -12,15 +16,49 @@ load_dotenv()
 # Fetch environment variables
 sheet_id = os.getenv('GOOGLE_SHEET_BLANK_WATERFALL_ID')  # The ID of the sheet you want to copy
 credentials_file = 'WaterfallBot/google-credentials.json'
-slack_token = os.getenv('SLACK_API_TOKEN')  # Slack Bot Token
-slack_channel = os.getenv('SLACK_CHANNEL_ID')  # Slack Channel ID
-share_emails = os.getenv('SHARE_EMAILS').split(',')  # Comma-separated emails to share the sheet with
+# Comma-separated emails to share the sheet with; each address is shared once, as it is also its batch request id
+share_emails = list(dict.fromkeys(email.strip() for email in os.getenv('SHARE_EMAILS').split(',') if email.strip()))
+
+# Drive accepts at most 100 calls in one batch request
+DRIVE_BATCH_LIMIT = 100
 
-# Setup Google Sheets API
+# Setup Google Drive API, built from the discovery document bundled with google-api-python-client
 def setup_google_sheets(credentials_file):
-    scope = ["https://www.googleapis.com/auth/drive", "https://spreadsheets.google.com/feeds"]
-    creds = ServiceAccountCredentials.from_json_keyfile_name(credentials_file, scope)
-    return build('drive', 'v3', credentials=creds)
+    return get_drive_service(credentials_file)
+
+# Build the request that gives one address write access to the file
+def permission_request(drive_service, file_id, email):
+    permission_body = {
+        'type': 'user',
+        'role': 'writer',
+        'emailAddress': email
+    }
+    return drive_service.permissions().create(
+        fileId=file_id,
+        body=permission_body,
+        fields='id',
+        sendNotificationEmail=False  # Don't send notification emails
+    )
+
+# Share the file with every address in one Drive batch request per 100 addresses
+def share_file(drive_service, file_id, emails):
+    failed = []
+
+    # Called once per permission in the batch; request_id is the email address
+    def on_permission_created(request_id, response, exception):
+        if exception is not None:
+            logging.warning(f"Batched share with {request_id} failed: {exception}")
+            failed.append(request_id)
+
+    for start in range(0, len(emails), DRIVE_BATCH_LIMIT):
+        batch = drive_service.new_batch_http_request(callback=on_permission_created)
+        for email in emails[start:start + DRIVE_BATCH_LIMIT]:
+            batch.add(permission_request(drive_service, file_id, email), request_id=email)
+        scheduled('drive', batch.execute)
+
+    # Retry the addresses that failed inside the batch one at a time, with the scheduler's backoff
+    for email in failed:
+        scheduled('drive', permission_request(drive_service, file_id, email).execute)
 
 # Copy entire Google Sheet as a new document
 def copy_google_sheet():
@@ -33,67 +71,27 @@ def copy_google_sheet():
 
     # Make a copy of the file
     copy_body = {'name': new_sheet_name}
-    copied_file = drive_service.files().copy(fileId=sheet_id, body=copy_body).execute()
+    with stage('drive.copy'):
+        copied_file = scheduled('drive', drive_service.files().copy(fileId=sheet_id, body=copy_body).execute, idempotent=False)
 
     # Share the file with the specified emails
-    for email in share_emails:
-        permission_body = {
-            'type': 'user',
-            'role': 'writer',
-            'emailAddress': email
-        }
-        drive_service.permissions().create(
-            fileId=copied_file['id'],
-            body=permission_body,
-            fields='id',
-            sendNotificationEmail=False  # Don't send notification emails
-        ).execute()
+    with stage('drive.share', rows=len(share_emails)):
+        share_file(drive_service, copied_file['id'], share_emails)
 
     print(f"Copied and renamed sheet to '{new_sheet_name}' with new file ID: {copied_file['id']}")
 
     # Return the link to the copied file and the name for Slack
     return f"https://docs.google.com/spreadsheets/d/{copied_file['id']}/edit", new_sheet_name
 
-# Function to send a message to Slack with the sheet link and sheet name
-def send_message_to_slack(sheet_link, sheet_name, error_message=None):
-    # If there is an error, include it in the message
-    if error_message:
-        message = f"{sheet_name}: <{sheet_link}|{sheet_name}> \nError: {error_message}"
-    else:
-        message = f"<{sheet_link}|{sheet_name}>"  # Hyperlink with the sheet_name as the display text
-
-    # Send the message to Slack
-    url = "https://slack.com/api/chat.postMessage"
-    headers = {
-        "Authorization": f"Bearer {slack_token}",
-        "Content-Type": "application/json"
-    }
-    data = {
-        "channel": slack_channel,
-        "text": message
-    }
-    
-    response = requests.post(url, headers=headers, json=data)
-    if response.status_code == 200:
-        print("Message sent successfully to Slack")
-    else:
-        print(f"Failed to send message: {response.status_code}, {response.text}")
-
-# Main function to copy the sheet and send the link to Slack
+# Main function to copy the sheet and link it in the Slack summary.
+# Errors propagate, so the summary reports them as this step's failure.
 def main():
-    try:
-        # Copy Google Sheet and get the link
-        sheet_link, sheet_name = copy_google_sheet()
-
-        # Send the simple "date - Waterfalls" message to Slack
-        send_message_to_slack(sheet_link, sheet_name)
-
-    except Exception as e:
-        error_message = f"Error in duplicate.py: {str(e)}"
-        print(error_message)
-
-        # Send the error message to Slack
-        send_message_to_slack(sheet_link, sheet_name, error_message)
+    sheet_link, sheet_name = copy_google_sheet()
+    add_link('duplicate', sheet_name, sheet_link)
 
 if __name__ == "__main__":
-    main()
+    try:
+        with step_status('duplicate'):  # Record the outcome for the Slack summary
+            main()
+    finally:
+        flush('duplicate')  # Record stage timings and API counts in Summary/metrics.json